@@ -1,221 +1,306 @@
-﻿from paddleocr import PaddleOCR
-import cv2
-from docx import Document
-from docx.shared import Pt, RGBColor
-from pathlib import Path
-import os
-import re
-import numpy as np
+﻿from pathlib import Path
+import argparse
 import time
 
-def light_preprocess(img_path):
-    img = cv2.imread(img_path)
-    if img is None:
-        return None
-    
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8,8))
-    enhanced = clahe.apply(gray)
-    denoised = cv2.fastNlMeansDenoising(enhanced, h=7)
-    
-    return denoised
-
-def split_long_image(img_path, chunk_height=3000):
-    img = cv2.imread(str(img_path))
-    
-    if img is None:
-        return []
-    
-    h, w = img.shape[:2]
-    
-    chunks = []
-    overlap = 200
-    
-    for y in range(0, h, chunk_height - overlap):
-        y_end = min(y + chunk_height, h)
-        chunk = img[y:y_end, :]
-        
-        temp_path = f'temp_chunk_{len(chunks)}.jpg'
-        cv2.imwrite(temp_path, chunk)
-        
-        preprocessed = light_preprocess(temp_path)
-        if preprocessed is not None:
-            temp_preprocessed = f'temp_prep_{len(chunks)}.jpg'
-            cv2.imwrite(temp_preprocessed, preprocessed)
-            chunks.append((temp_preprocessed, temp_path))
-        else:
-            chunks.append((temp_path, temp_path))
-    
-    return chunks
-
-def smart_postprocess(text):
-    text = re.sub(r'\s{2,}', ' ', text)
-    return text.strip()
-
-def is_noise(text):
-    text = text.strip()
-    if len(text) < 2:
-        return True
-    
-    if re.match(r'^[0-9<>|\.\-_~*:\'"]+$', text):
-        return True
-    
-    noise_patterns = ['UU', 'Mdo', '00000', '|0', '::', 'H']
-    if text in noise_patterns:
-        return True
-    
-    return False
-
-def group_texts_by_proximity(texts_with_boxes, vertical_threshold=100):
-    if not texts_with_boxes:
-        return []
-    
-    sorted_texts = sorted(texts_with_boxes, key=lambda x: x[1])
-    bubbles = []
-    current_bubble = [sorted_texts[0]]
-    
-    for i in range(1, len(sorted_texts)):
-        prev_y = current_bubble[-1][1]
-        curr_y = sorted_texts[i][1]
-        
-        if abs(curr_y - prev_y) < vertical_threshold:
-            current_bubble.append(sorted_texts[i])
-        else:
-            bubbles.append(current_bubble)
-            current_bubble = [sorted_texts[i]]
-    
-    if current_bubble:
-        bubbles.append(current_bubble)
-    
-    result = []
-    for bubble in bubbles:
-        combined_text = ' '.join([text for text, y, score in bubble])
-        combined_text = smart_postprocess(combined_text)
-        avg_score = sum([score for text, y, score in bubble]) / len(bubble)
-        result.append((combined_text, avg_score))
-    
-    return result
-
-print('='*70)
-print('EXTRACTION COMPLETE - CHAPITRE 35'.center(70))
-print('='*70)
-
-start_time = time.time()
-
-print('\nInitialisation de PaddleOCR...')
-ocr_ko = PaddleOCR(
-    lang='korean',
-    use_textline_orientation=True,
-    text_det_thresh=0.25,
-    text_det_box_thresh=0.55,
-    text_det_unclip_ratio=1.6
-)
-
-# Dossier source
-folder = Path(r'P:\19 - The Detective Agency For Regretful Male Leads (1)\Chapitre 35')
-
-# Trouver toutes les images
-images = sorted(folder.glob('*.jpeg')) + sorted(folder.glob('*.jpg')) + sorted(folder.glob('*.png'))
-images = sorted(set(images))
-
-print(f'\n{len(images)} pages trouvees\n')
-print('='*70)
-
-# Document Word
-doc = Document()
-doc.add_heading('The Detective Agency', 0)
-doc.add_heading('Chapitre 35 - Version Coréenne', 1)
-doc.add_paragraph(f'Extraction de {len(images)} pages')
-doc.add_paragraph()
-
-total_bubbles = 0
-
-for page_num, img_path in enumerate(images, 1):
-    print(f'\n[PAGE {page_num}/{len(images)}] {img_path.name}')
-    
-    # Lire dimensions
-    img = cv2.imread(str(img_path))
-    if img is None:
-        print('  ERREUR: Impossible de lire l\'image')
-        continue
-    
-    h, w = img.shape[:2]
-    print(f'  Taille: {w}x{h} pixels')
-    
-    # Titre dans le document
-    doc.add_heading(f'Page {page_num}', level=2)
-    
-    # Decouper si necessaire
-    chunks = split_long_image(img_path)
-    if len(chunks) > 1:
-        print(f'  Decoupee en {len(chunks)} morceaux')
-    
-    page_bubbles = []
-    
-    for prep_path, orig_path in chunks:
-        try:
-            result = ocr_ko.predict(prep_path)
-            
-            if result and len(result) > 0:
-                for page_result in result:
-                    if 'rec_texts' in page_result and 'rec_boxes' in page_result:
-                        texts = page_result['rec_texts']
-                        scores = page_result['rec_scores']
-                        boxes = page_result['rec_boxes']
-                        
-                        texts_with_positions = []
-                        for text, score, box in zip(texts, scores, boxes):
-                            if score > 0.70 and text.strip() and not is_noise(text):
-                                y_pos = box[1]
-                                texts_with_positions.append((text, y_pos, score))
-                        
-                        bubbles = group_texts_by_proximity(texts_with_positions)
-                        
-                        for bubble_text, avg_score in bubbles:
-                            page_bubbles.append(bubble_text)
-            
-            # Nettoyer
-            if os.path.exists(prep_path):
-                os.remove(prep_path)
-            if os.path.exists(orig_path) and orig_path != prep_path:
-                os.remove(orig_path)
-                
-        except Exception as e:
-            print(f'  Erreur: {e}')
-    
-    print(f'  -> {len(page_bubbles)} bulles detectees')
-    total_bubbles += len(page_bubbles)
-    
-    # Ajouter au document
-    if page_bubbles:
-        for idx, text in enumerate(page_bubbles, 1):
-            p = doc.add_paragraph()
-            
-            num_run = p.add_run(f'{idx}. ')
-            num_run.bold = True
-            num_run.font.size = Pt(11)
-            
-            text_run = p.add_run(text)
-            text_run.font.color.rgb = RGBColor(0, 0, 255)
-            text_run.font.size = Pt(11)
-        
-        doc.add_paragraph()
-    else:
-        doc.add_paragraph('[Aucun texte detecte]')
-        doc.add_paragraph()
-
-# Sauvegarder
-output = folder / 'Chapitre_35_COMPLET.docx'
-doc.save(str(output))
-
-elapsed = time.time() - start_time
-minutes = int(elapsed // 60)
-seconds = int(elapsed % 60)
-
-print('\n' + '='*70)
-print(f'EXTRACTION TERMINEE !'.center(70))
-print('='*70)
-print(f'Total: {total_bubbles} bulles extraites de {len(images)} pages')
-print(f'Temps: {minutes}m {seconds}s')
-print(f'Fichier: {output}')
-print('='*70)
+from manhwa_core import (group_records, job_settings, make_options, ExtractionCancelled, PREPROCESS_PROFILES,
+                         TEXT_FILTER_SCORE)
+from manhwa_checkpoint import ChapterJob
+from manhwa_cache import OcrCache, default_cache_path
+from manhwa_pool import iter_pages, default_threads
+from manhwa_server import connect_server
+from manhwa_trace import Tracer
+from manhwa_output import open_writers, WRITERS
+from manhwa_sources import open_source, page_name, PDF_DPI
+
+# Dossier source par defaut
+DEFAULT_FOLDER = r'P:\19 - The Detective Agency For Regretful Male Leads (1)\Chapitre 35'
+DEFAULT_TITLE = 'The Detective Agency'
+LANGS = ['korean']
+
+
+def add_extraction_args(parser):
+    '''Options communes a l'extraction d'un chapitre et d'une serie'''
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Nombre de processus OCR (defaut: 1, tout dans ce processus ; '
+                             'au-dela, progression et arret page par page)')
+    parser.add_argument('-t', '--threads', type=int, default=None,
+                        help='Threads de calcul par processus (defaut: coeurs / processus)')
+    parser.add_argument('--prefetch', type=int, default=4,
+                        help='Pages lues et pretraitees en avance sur l\'OCR (avec 1 processus)')
+    parser.add_argument('--rec-batch', type=int, default=4,
+                        help='Pages dont les lignes sont reconnues ensemble (0 = un appel par morceau)')
+    parser.add_argument('--cache', default=None,
+                        help=f'Fichier de cache OCR (defaut: {default_cache_path()})')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Ne pas lire ni ecrire le cache OCR')
+    parser.add_argument('--no-server', action='store_true',
+                        help='Ne pas utiliser le serveur OCR local (manhwa_server.py) meme s\'il tourne')
+    parser.add_argument('--restart', action='store_true',
+                        help='Ignorer les pages deja extraites lors d\'un lancement precedent')
+    # 'gutters' : ne coupe que dans les gouttieres et saute les bandes vides
+    parser.add_argument('--split-mode', choices=['fixed', 'gutters'], default='fixed',
+                        help='Decoupage des pages longues (gutters : seulement dans les gouttieres, '
+                             'bandes vides sautees)')
+    parser.add_argument('--chunk-height', type=int, default=None,
+                        help='Hauteur des morceaux (defaut: la plus grande que le detecteur lit sans reduire)')
+    parser.add_argument('--tiled', choices=['auto', 'always', 'never'], default='auto',
+                        help='Lire les PNG par bandes, a memoire bornee (auto: pages tres longues)')
+    parser.add_argument('--phash', action='store_true',
+                        help='Reprendre le texte des bandes deja lues (credits, bannieres), '
+                             'voir manhwa_phash.py ; necessite le cache')
+    parser.add_argument('--dpi', type=int, default=PDF_DPI,
+                        help='Resolution du rendu des pages d\'un PDF')
+    parser.add_argument('--formats', nargs='+', choices=sorted(WRITERS), default=['docx'],
+                        help='Fichiers de sortie, ecrits page par page (jsonl : boites et scores)')
+    parser.add_argument('--trace', default=None,
+                        help='Fichier de trace (.json : format Chrome trace, sinon JSONL)')
+    # 'auto' : CLAHE partout, debruitage seulement sur les bandes bruitees
+    parser.add_argument('--preprocess', choices=sorted(PREPROCESS_PROFILES), default='full',
+                        help='Profil de pretraitement')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Pages lues sans pretraitement, lignes peu sures relues agrandies et '
+                             'fortement pretraitees (remplace --preprocess)')
+    # Sans valeur : seuil par defaut (TEXT_FILTER_SCORE) ; plus haut = plus de morceaux sautes
+    parser.add_argument('--text-filter', type=float, nargs='?', const=TEXT_FILTER_SCORE, default=None,
+                        metavar='SEUIL',
+                        help='Sauter sans pretraitement ni OCR les morceaux ou aucun texte n\'est '
+                             f'probable (seuil par defaut: {TEXT_FILTER_SCORE}, voir manhwa_bench.py --art)')
+    parser.add_argument('--roi', action='store_true',
+                        help='Detecter le texte seulement dans les bulles et cartouches clairs '
+                             '(morceau entier si aucun n\'est trouve)')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Extraction OCR d\'un chapitre complet')
+    parser.add_argument('folder', nargs='?', default=DEFAULT_FOLDER,
+                        help='Dossier des pages du chapitre, archive CBZ/ZIP ou PDF')
+    parser.add_argument('--title', default=DEFAULT_TITLE,
+                        help='Titre du document')
+    add_extraction_args(parser)
+    return parser.parse_args()
+
+
+# --tiled -> option 'tiled' (None : selon la hauteur de la page)
+TILED_CHOICES = {'auto': None, 'always': True, 'never': False}
+
+
+def extraction_options(args):
+    return make_options(split_mode=args.split_mode, profile=args.preprocess, roi=args.roi,
+                        chunk_height=args.chunk_height, tiled=TILED_CHOICES[args.tiled],
+                        phash=args.phash, cascade=args.cascade, text_filter=args.text_filter,
+                        trace=True)
+
+
+def find_images(folder, dpi=PDF_DPI):
+    '''Pages d'un chapitre (dossier, archive ou PDF), dans l'ordre naturel'''
+    return open_source(folder, dpi).pages()
+
+
+def extract_chapter(folder, args, options, tracer, cache=None, server=None, engines=None,
+                    pool=None, title=DEFAULT_TITLE, cancel=None):
+    '''Extrait un chapitre et ecrit ses fichiers de sortie
+
+    folder : dossier d'images, archive CBZ/ZIP ou PDF (voir manhwa_sources).
+    engines / pool / server : moteurs deja charges, partages entre chapitres
+    (sinon iter_pages les cree pour ce chapitre). Retourne les statistiques
+    du chapitre.
+    cancel() : vrai pour s'arreter au morceau suivant (un processus, sans
+    serveur), sinon a la page suivante ; ExtractionCancelled est alors levee
+    apres l'ecriture des pages finies (le manifeste permet la reprise).
+    '''
+    folder = Path(folder)
+    source = open_source(folder, args.dpi)
+    threads = args.threads or default_threads(args.workers)
+
+    print('='*70)
+    print(f'EXTRACTION COMPLETE - {source.name.upper()}'.center(70))
+    print('='*70)
+
+    start_time = time.time()
+
+    # Trouver toutes les pages (lues une a une, meme depuis une archive ou un PDF)
+    images = source.pages()
+
+    print(f'\n{len(images)} pages trouvees')
+    if server is None and engines is None and pool is None:
+        print(f'Initialisation de PaddleOCR ({args.workers} processus x {threads} threads)...\n')
+    print('='*70)
+
+    # Sorties (DOCX, JSONL, Markdown) ecrites au fur et a mesure
+    output = open_writers(source.output_base(), args.formats,
+                          title, f'{source.name} - Version Coréenne',
+                          [f'Extraction de {len(images)} pages'])
+
+    total_bubbles = 0
+    total_rows = 0
+    total_skipped = 0
+    rec_lines = 0
+    rec_seconds = 0.0
+    bands = 0
+    denoised_bands = 0
+    det_area = 0
+    chunk_area = 0
+    bands_reused = 0
+    bands_skipped = 0
+    retried = 0
+    recovered = 0
+    chunks = 0
+    filtered = 0
+    scores = []
+
+    cached_pages = 0
+
+    # Reprise : les pages terminees lors d'un lancement precedent sont relues du manifeste
+    job = ChapterJob(folder, images, job_settings(LANGS, options), source.job_path())
+    if args.restart:
+        job.reset()
+    elif job.done:
+        print(f'Reprise: {len(job.done)}/{len(images)} pages deja extraites ({job.path.name})')
+    resumed_pages = len(job.done)
+
+    def on_chunk(result, y_end):
+        if cancel():
+            raise ExtractionCancelled()
+
+    # Les pages reviennent dans l'ordre, quel que soit le processus qui les a traitees
+    fresh = iter_pages(job.pending(), LANGS, workers=args.workers, threads=threads,
+                       options=options, engines=engines, prefetch=args.prefetch,
+                       rec_batch_pages=max(1, args.rec_batch), batched=args.rec_batch > 0,
+                       cache=cache, server=server, pool=pool,
+                       on_chunk=None if cancel is None else on_chunk)
+
+    try:
+        for page_num, (img_path, page) in enumerate(zip(images, job.iter_results(fresh)), 1):
+            print(f'\n[PAGE {page_num}/{len(images)}] {page_name(img_path)}')
+
+            if not page['height']:
+                print(f'  ERREUR: {page["error"]}')
+                output.write_page(page_num, page, [])
+                continue
+
+            h, w = page['height'], page['width']
+            print(f'  Taille: {w}x{h} pixels')
+
+            if page['cached']:
+                cached_pages += 1
+                print('  (cache)')
+            rec_lines += page['rec_lines']
+            rec_seconds += page['rec_seconds']
+            tracer.add_page(page)
+            bands += page['bands']
+            denoised_bands += page['denoised_bands']
+            det_area += page.get('det_area', 0)
+            chunk_area += page.get('chunk_area', 0)
+            bands_reused += page.get('bands_reused', 0)
+            bands_skipped += page.get('bands_skipped', 0)
+            retried += page.get('retried', 0)
+            recovered += page.get('recovered', 0)
+            chunks += page['chunks']
+            filtered += page.get('filtered', 0)
+            scores.extend(rec['score'] for rec in page['records'])
+
+            skipped = page['skipped_rows']
+            total_rows += h
+            total_skipped += skipped
+            if page['chunks'] > 1:
+                print(f'  Decoupee en {page["chunks"]} morceaux')
+            if page.get('filtered'):
+                print(f'  {page["filtered"]} morceaux sans texte sautes')
+            if page.get('bands_reused') or page.get('bands_skipped'):
+                print(f'  Bandes connues: {page["bands_reused"]} reprises, {page["bands_skipped"]} ignorees')
+            if skipped:
+                print(f'  {skipped} lignes vides ignorees ({skipped / h:.0%})')
+            if page['error']:
+                print(f'  Erreur: {page["error"]}')
+
+            with tracer.span('group', boxes=len(page['records'])):
+                page_bubbles = group_records(page['records'])
+
+            print(f'  -> {len(page_bubbles)} bulles detectees')
+            total_bubbles += len(page_bubbles)
+
+            # Ajouter aux fichiers de sortie
+            with tracer.span('write', boxes=len(page_bubbles)):
+                output.write_page(page_num, page, page_bubbles)
+
+            # Pool ou serveur : arret entre deux pages
+            if cancel is not None and cancel() and page_num < len(images):
+                raise ExtractionCancelled()
+    except ExtractionCancelled:
+        fresh.close()
+        output.close()
+        raise
+
+    # Sauvegarder
+    with tracer.span('save'):
+        output.close()
+
+    elapsed = time.time() - start_time
+    minutes = int(elapsed // 60)
+    seconds = int(elapsed % 60)
+
+    print('\n' + '='*70)
+    print(f'EXTRACTION TERMINEE !'.center(70))
+    print('='*70)
+    print(f'Total: {total_bubbles} bulles extraites de {len(images)} pages')
+    if total_rows:
+        print(f'Lignes vides ignorees: {total_skipped}/{total_rows} ({total_skipped / total_rows:.0%})')
+    if rec_seconds:
+        mode = 'par lots' if args.rec_batch > 0 else 'par morceau'
+        print(f'Reconnaissance ({mode}): {rec_lines} lignes, {rec_lines / rec_seconds:.1f} lignes/s')
+    if args.cascade and rec_lines:
+        print(f'Deuxieme passe: {retried}/{rec_lines} lignes relues ({retried / rec_lines:.0%}), '
+              f'{recovered} recuperees')
+    if args.text_filter is not None and chunks + filtered:
+        print(f'Morceaux sans texte sautes: {filtered}/{chunks + filtered} '
+              f'({filtered / (chunks + filtered):.0%}, seuil {args.text_filter:g})')
+    if scores:
+        print(f'Confiance moyenne: {sum(scores) / len(scores):.1%} (pretraitement {args.preprocess})')
+    if bands:
+        print(f'Debruitage: {denoised_bands}/{bands} bandes')
+    if args.roi and chunk_area:
+        print(f'Surface ignoree par la detection: {1 - det_area / chunk_area:.0%} (hors bulles)')
+    if cache is not None:
+        print(f'Cache: {cached_pages}/{len(images)} pages deja extraites ({cache.path})')
+    if bands_reused or bands_skipped:
+        print(f'Bandes connues: {bands_reused} reprises, {bands_skipped} ignorees (manhwa_phash.py list)')
+    print(f'Temps: {minutes}m {seconds}s')
+    for path in output.paths:
+        print(f'Fichier: {path}')
+    print('='*70)
+
+    return {
+        'chapter': source.name,
+        'folder': str(folder),
+        'pages': len(images),
+        'resumed_pages': resumed_pages,
+        'cached_pages': cached_pages,
+        'bubbles': total_bubbles,
+        'seconds': elapsed,
+        'pages_per_sec': len(images) / elapsed if elapsed else None,
+        'files': [str(path) for path in output.paths],
+    }
+
+
+def main():
+    args = parse_args()
+    options = extraction_options(args)
+    tracer = Tracer()
+    cache = None if args.no_cache else OcrCache(args.cache)
+
+    # Serveur OCR local : modeles deja charges, pas de temps de demarrage
+    server = None if args.no_server else connect_server()
+    if server is not None:
+        print(f'Serveur OCR local: {server.info["host"]}:{server.info["port"]}')
+
+    extract_chapter(Path(args.folder), args, options, tracer, cache, server, title=args.title)
+
+    # Ou passe le temps (pages deja extraites lors d'un lancement precedent non comprises)
+    print('\n' + tracer.format_summary())
+    if args.trace:
+        tracer.write(args.trace)
+        print(f'\nTrace: {args.trace}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+﻿from pathlib import Path
+import argparse
+import json
+import time
+
+from manhwa_core import create_engines, job_settings
+from manhwa_cache import OcrCache
+from manhwa_checkpoint import ChapterJob
+from manhwa_output import WRITERS
+from manhwa_pool import PagePool, default_threads
+from manhwa_server import connect_server
+from manhwa_sources import is_source_file, natural_key, open_source, page_stamp, PDF_DPI
+from manhwa_trace import Tracer
+from extract_chapitre_complet import (add_extraction_args, extract_chapter, extraction_options,
+                                      find_images, LANGS)
+
+# Dossier de la serie par defaut (un sous-dossier par chapitre)
+DEFAULT_ROOT = r'P:\19 - The Detective Agency For Regretful Male Leads (1)'
+SUMMARY_FILENAME = 'resume_extraction.json'
+
+
+def find_chapters(root, newest_first=True):
+    '''Sous-dossiers contenant des pages, archives et PDF, du plus recent au plus ancien (ou l'inverse)'''
+    chapters = [p for p in Path(root).iterdir() if not p.name.startswith('.')
+                and (p.is_dir() and find_images(p) or p.is_file() and is_source_file(p))]
+    return sorted(chapters, key=lambda p: natural_key(p.stem if p.is_file() else p.name),
+                  reverse=newest_first)
+
+
+def is_up_to_date(folder, formats, settings, dpi=PDF_DPI):
+    '''Toutes les pages extraites avec ces reglages et sorties ecrites depuis'''
+    source = open_source(folder, dpi)
+    try:
+        images = source.pages()
+    except Exception:
+        # Archive ou PDF illisible : l'extraction du chapitre signalera l'erreur
+        return False
+    # Lecture seule : le manifeste n'est cree ou reecrit que si le chapitre est extrait
+    path = ChapterJob.manifest_path(folder, source.job_path())
+    if not images or not path.exists():
+        # Chapitre sans page ou jamais extrait
+        return False
+    done, _ = ChapterJob.load_manifest(path, images, settings)
+    if len(done) < len(images):
+        return False
+
+    newest = max([page_stamp(p)[1] / 1e9 for p in images] + [path.stat().st_mtime])
+    base = source.output_base()
+    for fmt in formats:
+        path = Path(f'{base}{WRITERS[fmt].suffix}')
+        if not path.exists() or path.stat().st_mtime < newest:
+            return False
+    return True
+
+
+def open_engines(args, options, cache):
+    '''Un seul jeu de moteurs pour plusieurs chapitres : (server, engines, pool)
+
+    Serveur local s'il tourne, sinon moteurs charges dans ce processus
+    (-w 1) ou pool de processus ; les deux autres valent None.
+    '''
+    threads = args.threads or default_threads(args.workers)
+    server = None if args.no_server else connect_server()
+    engines = None
+    pool = None
+    if server is not None:
+        print(f'Serveur OCR local: {server.info["host"]}:{server.info["port"]}')
+    elif args.workers <= 1:
+        print(f'Initialisation de PaddleOCR ({threads} threads)...')
+        engines = create_engines(LANGS, cpu_threads=threads)
+    else:
+        print(f'Initialisation de PaddleOCR ({args.workers} processus x {threads} threads)...')
+        pool = PagePool(LANGS, args.workers, threads, options, args.rec_batch > 0, cache)
+    return server, engines, pool
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Extraction OCR de tous les chapitres d\'une serie')
+    parser.add_argument('root', nargs='?', default=DEFAULT_ROOT,
+                        help='Dossier de la serie (un sous-dossier, une archive CBZ/ZIP ou un PDF par chapitre)')
+    parser.add_argument('--title', default=None,
+                        help='Titre des documents (defaut: nom du dossier de la serie)')
+    parser.add_argument('--oldest-first', action='store_true',
+                        help='Traiter les premiers chapitres d\'abord (defaut: les plus recents)')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='Nombre maximum de chapitres a extraire')
+    parser.add_argument('--force', action='store_true',
+                        help='Extraire aussi les chapitres deja a jour')
+    add_extraction_args(parser)
+    return parser.parse_args()
+
+
+def print_summary(chapters, elapsed):
+    print('\n' + '='*70)
+    print('RESUME DE LA SERIE'.center(70))
+    print('='*70)
+    print(f'{"chapitre":<28} {"etat":<8} {"pages":>6} {"bulles":>7} {"temps":>8} {"pages/s":>8}')
+    for chapter in chapters:
+        rate = f'{chapter["pages_per_sec"]:.2f}' if chapter.get('pages_per_sec') else ''
+        seconds = f'{chapter["seconds"]:.0f}s' if chapter.get('seconds') else ''
+        print(f'{chapter["chapter"][:28]:<28} {chapter["status"]:<8} {chapter.get("pages", ""):>6} '
+              f'{chapter.get("bubbles", ""):>7} {seconds:>8} {rate:>8}')
+
+    done = [c for c in chapters if c['status'] == 'ok']
+    pages = sum(c['pages'] for c in done)
+    minutes, seconds = int(elapsed // 60), int(elapsed % 60)
+    print(f'\n{len(done)} chapitres extraits, {pages} pages en {minutes}m {seconds}s'
+          + (f' ({pages / elapsed:.2f} pages/s)' if elapsed and pages else ''))
+
+
+def main():
+    args = parse_args()
+    root = Path(args.root)
+    title = args.title or root.name
+    options = extraction_options(args)
+    settings = job_settings(LANGS, options)
+    tracer = Tracer()
+    cache = None if args.no_cache else OcrCache(args.cache)
+    start_time = time.time()
+
+    chapters = find_chapters(root, newest_first=not args.oldest_first)
+    print(f'{len(chapters)} chapitres trouves dans {root}')
+
+    summary = []
+    todo = []
+    for folder in chapters:
+        if not args.force and not args.restart and is_up_to_date(folder, args.formats, settings, args.dpi):
+            summary.append({'chapter': folder.name, 'folder': str(folder), 'status': 'a jour'})
+        else:
+            todo.append(folder)
+    if args.limit is not None:
+        for folder in todo[args.limit:]:
+            summary.append({'chapter': folder.name, 'folder': str(folder), 'status': 'reporte'})
+        todo = todo[:args.limit]
+    print(f'{len(todo)} a extraire, {len(chapters) - len(todo)} ignores')
+
+    # Un seul jeu de moteurs pour toute la serie : serveur local, pool ou ce processus
+    server = engines = pool = None
+    if todo:
+        server, engines, pool = open_engines(args, options, cache)
+
+    try:
+        for folder in todo:
+            print()
+            try:
+                stats = extract_chapter(folder, args, options, tracer, cache, server, engines, pool, title)
+                stats['status'] = 'ok'
+            except Exception as e:
+                print(f'ERREUR ({folder.name}): {e}')
+                stats = {'chapter': folder.name, 'folder': str(folder), 'status': 'erreur', 'error': str(e)}
+            summary.append(stats)
+    except KeyboardInterrupt:
+        print('\nInterrompu : les pages deja extraites reprendront au prochain lancement')
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    elapsed = time.time() - start_time
+    order = {str(folder): i for i, folder in enumerate(chapters)}
+    summary.sort(key=lambda c: order.get(c['folder'], len(order)))
+    print_summary(summary, elapsed)
+
+    report = root / SUMMARY_FILENAME
+    with open(report, 'w', encoding='utf-8') as f:
+        json.dump({'root': str(root), 'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start_time)),
+                   'seconds': elapsed, 'options': options, 'formats': args.formats,
+                   'chapters': summary}, f, indent=2, ensure_ascii=False)
+    print(f'Resume: {report}')
+
+    print('\n' + tracer.format_summary())
+    if args.trace:
+        tracer.write(args.trace)
+        print(f'\nTrace: {args.trace}')
+
+
+if __name__ == '__main__':
+    main()
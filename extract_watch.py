@@ -0,0 +1,392 @@
+﻿'''Surveillance d'un dossier de serie : chaque chapitre depose est extrait
+
+    python extract_watch.py "P:\\Series\\The Detective Agency" --settle 30
+
+Un chapitre (sous-dossier contenant des pages, archive CBZ/ZIP ou PDF)
+est mis en file quand ses images n'ont plus change depuis --settle secondes, puis extrait avec les
+memes moteurs que le mode serie ; les fichiers de sortie sont ecrits dans
+le dossier du chapitre. La file est gardee dans .manhwa_watch.json a la
+racine : un redemarrage reprend les chapitres en attente ou interrompus.
+
+inotify sous Linux ; sinon, ou avec --poll (partages reseau, dont les
+ecritures distantes ne declenchent pas d'evenement), la racine est
+parcourue toutes les --poll-interval secondes.
+'''
+from pathlib import Path
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+
+from manhwa_core import job_settings, ExtractionCancelled
+from manhwa_cache import OcrCache
+from manhwa_trace import Tracer
+from manhwa_sources import is_source_file, IMAGE_SUFFIXES
+from extract_chapitre_complet import add_extraction_args, extract_chapter, extraction_options, LANGS
+from extract_serie import find_chapters, is_up_to_date, open_engines
+
+QUEUE_FILENAME = '.manhwa_watch.json'
+SETTLE_SECONDS = 30
+POLL_INTERVAL = 10
+# Attente maximale du chapitre en cours a l'arret (Ctrl+C)
+STOP_TIMEOUT = 30
+
+# inotify (linux/inotify.h)
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def log(message):
+    print(f'[{time.strftime("%Y-%m-%d %H:%M:%S")}] {message}', flush=True)
+
+
+def chapter_snapshot(folder):
+    '''Etat des pages d'un chapitre : [(nom, taille, date)] ; [] s'il a disparu'''
+    if is_source_file(folder):
+        try:
+            stat = os.stat(folder)
+        except OSError:
+            return []
+        return [[Path(folder).name, stat.st_size, stat.st_mtime_ns]]
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return []
+    snapshot = []
+    for entry in entries:
+        if entry.is_file() and Path(entry.name).suffix.lower() in IMAGE_SUFFIXES:
+            stat = entry.stat()
+            snapshot.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    return sorted(snapshot)
+
+
+def is_chapter(path):
+    '''Sous-dossier, archive ou PDF (hors fichiers caches)'''
+    return not path.name.startswith('.') and (path.is_dir() or path.is_file() and is_source_file(path))
+
+
+class ChapterQueue:
+    '''File persistante : dossier -> etat, dates et statistiques
+
+    etats : 'waiting' (pages encore en cours de copie), 'queued', 'running',
+    'done', 'error'. Chaque changement est ecrit tout de suite (fichier
+    temporaire puis remplacement).
+    '''
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.chapters = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.chapters = json.load(f)['chapters']
+        except (OSError, ValueError, KeyError):
+            pass
+        # Extraction interrompue par un arret : elle reprendra (points de controle)
+        now = time.time()
+        for entry in self.chapters.values():
+            if entry['status'] == 'running':
+                entry['status'] = 'queued'
+            if entry['status'] == 'waiting':
+                entry['changed'] = now
+        self._save()
+
+    def _save(self):
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'chapters': self.chapters}, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def touch(self, folder, when):
+        '''Le chapitre vient de changer : il attend que la copie se termine'''
+        with self._lock:
+            entry = self.chapters.setdefault(str(folder), {'seen': when})
+            if entry.get('status') in ('waiting', 'running'):
+                entry['changed'] = when
+                if entry['status'] == 'running':
+                    entry['dirty'] = True
+            else:
+                entry.update(status='waiting', changed=when, snapshot=None, seen=entry.get('seen') or when)
+            self._save()
+
+    def settle(self, settle_seconds, now):
+        '''Passe en file les chapitres stables depuis settle_seconds ; retourne les nouveaux'''
+        ready = []
+        with self._lock:
+            for folder, entry in self.chapters.items():
+                if entry['status'] != 'waiting' or now - entry['changed'] < settle_seconds:
+                    continue
+                # Confirme par l'etat des fichiers (evenements perdus, partage reseau)
+                snapshot = chapter_snapshot(folder)
+                if snapshot != entry['snapshot']:
+                    entry.update(snapshot=snapshot, changed=now)
+                elif not snapshot:
+                    del self.chapters[folder]
+                    break
+                else:
+                    entry['status'] = 'queued'
+                    ready.append(folder)
+            self._save()
+        return ready
+
+    def next_queued(self):
+        with self._lock:
+            queued = [folder for folder, entry in self.chapters.items() if entry['status'] == 'queued']
+            if not queued:
+                return None
+            # Le plus ancien depot d'abord
+            folder = min(queued, key=lambda f: self.chapters[f]['seen'])
+            self.chapters[folder].update(status='running', started=time.time(), dirty=False)
+            self._save()
+            return folder
+
+    def finish(self, folder, **info):
+        '''Fin d'extraction ; un chapitre modifie pendant ce temps est re-examine'''
+        with self._lock:
+            entry = self.chapters[folder]
+            entry.update(info, finished=time.time())
+            if entry.pop('dirty', False):
+                entry.update(status='waiting', snapshot=None, seen=entry['finished'])
+            self._save()
+
+    def __len__(self):
+        return sum(entry['status'] in ('waiting', 'queued', 'running') for entry in self.chapters.values())
+
+
+class PollWatcher:
+    '''Parcours periodique de la racine : chapitres dont les pages ont change'''
+
+    def __init__(self, root, interval=POLL_INTERVAL):
+        self.root = Path(root)
+        self.interval = interval
+        self._snapshots = self._scan()
+        self._next = time.monotonic() + interval
+
+    def _scan(self):
+        try:
+            folders = [p for p in self.root.iterdir() if is_chapter(p)]
+        except OSError:
+            return {}
+        return {str(folder): chapter_snapshot(folder) for folder in folders}
+
+    def wait(self, timeout):
+        time.sleep(max(0.0, min(timeout, self._next - time.monotonic())))
+        if time.monotonic() < self._next:
+            return set()
+        self._next = time.monotonic() + self.interval
+        snapshots = self._scan()
+        changed = {folder for folder in set(snapshots) | set(self._snapshots)
+                   if snapshots.get(folder) != self._snapshots.get(folder)}
+        self._snapshots = snapshots
+        return {folder for folder in changed if folder in snapshots}
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    '''Evenements inotify sur la racine et chaque chapitre (Linux, sans dependance)'''
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self._dirs = {}
+        self._add(self.root)
+        for folder in self.root.iterdir():
+            if folder.is_dir() and not folder.name.startswith('.'):
+                self._add(folder)
+
+    def _add(self, folder):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(folder)), WATCH_MASK)
+        if wd >= 0:
+            self._dirs[wd] = Path(folder)
+
+    def wait(self, timeout):
+        '''Chapitres touches pendant au plus timeout secondes'''
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+            name = data[pos + EVENT_HEADER.size:pos + EVENT_HEADER.size + length].rstrip(b'\0')
+            pos += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Evenements perdus : tous les chapitres sont re-examines
+                changed.update(str(p) for p in self.root.iterdir() if is_chapter(p))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            folder = self._dirs.get(wd)
+            if folder is None:
+                continue
+            if folder == self.root:
+                name = os.fsdecode(name)
+                if name.startswith('.'):
+                    continue
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add(self.root / name)
+                if mask & IN_ISDIR or is_source_file(name):
+                    changed.add(str(self.root / name))
+            elif Path(os.fsdecode(name)).suffix.lower() in IMAGE_SUFFIXES or mask & IN_DELETE_SELF:
+                changed.add(str(folder))
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+def open_watcher(root, poll=False, interval=POLL_INTERVAL):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root)
+        except OSError as e:
+            log(f'inotify indisponible ({e}) : parcours toutes les {interval}s')
+    return PollWatcher(root, interval)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Extraction automatique des chapitres deposes dans un dossier')
+    parser.add_argument('root', help='Dossier de la serie surveille (un sous-dossier par chapitre)')
+    parser.add_argument('--title', default=None,
+                        help='Titre des documents (defaut: nom du dossier surveille)')
+    parser.add_argument('--settle', type=float, default=SETTLE_SECONDS,
+                        help='Secondes sans changement avant d\'extraire un chapitre')
+    parser.add_argument('--poll', action='store_true',
+                        help='Parcourir le dossier au lieu d\'utiliser inotify (partages reseau)')
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL,
+                        help='Secondes entre deux parcours (avec --poll ou sans inotify)')
+    parser.add_argument('--once', action='store_true',
+                        help='Extraire les chapitres en attente puis quitter')
+    add_extraction_args(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    root = Path(args.root)
+    title = args.title or root.name
+    options = extraction_options(args)
+    settings = job_settings(LANGS, options)
+    tracer = Tracer()
+    cache = None if args.no_cache else OcrCache(args.cache)
+
+    chapters = ChapterQueue(root / QUEUE_FILENAME)
+    watcher = open_watcher(root, args.poll, args.poll_interval)
+
+    # Chapitres deja presents et pas encore extraits (ou modifies depuis)
+    now = time.time()
+    for folder in find_chapters(root, newest_first=False):
+        entry = chapters.chapters.get(str(folder))
+        if entry is None or entry['status'] in ('done', 'error'):
+            if not is_up_to_date(folder, args.formats, settings, args.dpi):
+                chapters.touch(folder, now)
+    log(f'Surveillance de {root} ({type(watcher).__name__}), {len(chapters)} chapitres en attente')
+
+    server = engines = pool = None
+    todo = queue.Queue()
+    stop = threading.Event()
+
+    def worker():
+        # Moteurs charges au premier chapitre seulement, puis gardes
+        nonlocal server, engines, pool
+        while not stop.is_set():
+            try:
+                folder = todo.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if folder is None:
+                return
+            if server is None and engines is None and pool is None:
+                server, engines, pool = open_engines(args, options, cache)
+            entry = chapters.chapters[folder]
+            log(f'Extraction de {folder}')
+            try:
+                stats = extract_chapter(Path(folder), args, options, tracer, cache, server, engines, pool, title,
+                                        cancel=stop.is_set)
+            except ExtractionCancelled:
+                # Reste 'running' : repris au prochain lancement, depuis le manifeste
+                log(f'Interrompu : {Path(folder).name}')
+            except Exception as e:
+                log(f'ERREUR ({folder}): {e}')
+                chapters.finish(folder, status='error', error=str(e))
+            else:
+                latency = time.time() - entry['seen']
+                chapters.finish(folder, status='done', error=None, pages=stats['pages'],
+                                bubbles=stats['bubbles'], seconds=stats['seconds'], latency=latency,
+                                files=stats['files'])
+                log(f'Termine : {Path(folder).name}, {stats["pages"]} pages en {stats["seconds"]:.0f}s, '
+                    f'{latency:.0f}s apres le depot')
+            finally:
+                todo.task_done()
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+
+    busy = False
+    try:
+        while True:
+            for folder in watcher.wait(1.0):
+                if chapter_snapshot(folder):
+                    chapters.touch(folder, time.time())
+            for folder in chapters.settle(args.settle, time.time()):
+                log(f'Chapitre pret : {Path(folder).name}')
+
+            # Un chapitre a la fois : le suivant quand le precedent est fini
+            if busy and todo.unfinished_tasks == 0:
+                busy = False
+            if not busy:
+                folder = chapters.next_queued()
+                if folder is not None:
+                    busy = True
+                    todo.put(folder)
+            if args.once and not busy and not len(chapters):
+                break
+    except KeyboardInterrupt:
+        log('Arret : les chapitres en attente reprendront au prochain lancement')
+    finally:
+        # Le chapitre en cours s'arrete au morceau (ou a la page) suivant
+        stop.set()
+        todo.put(None)
+        thread.join(STOP_TIMEOUT)
+        if thread.is_alive():
+            log(f'Chapitre en cours toujours actif apres {STOP_TIMEOUT}s : abandonne (sera repris)')
+        watcher.close()
+        if pool is not None:
+            pool.terminate()
+        if server is not None:
+            server.close()
+
+
+if __name__ == '__main__':
+    main()
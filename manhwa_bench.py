@@ -0,0 +1,463 @@
+'''Benchmark hors ligne sur des pages synthetiques (bulles dessinees avec Pillow)
+
+    python manhwa_bench.py --heights 3000 8000 15000 --noise 0 8 --output bench.json
+    python manhwa_bench.py --compare bench.json
+
+Chaque page est une longue bande blanche avec des bulles de texte connu
+(coreen et anglais) ; le bruit est ajoute puis la page est encodee en JPEG
+comme un vrai webtoon. Le meme seed donne exactement les memes pages.
+Le rapport JSON contient le debit (pages/s), les percentiles de latence
+par etape, le pic de memoire et la precision par caractere.
+
+--chunk-heights auto 1500 3000 compare plusieurs decoupages sur les memes
+pages (morceaux par page, debit, detection, precision).
+
+--art 0.5 --text-filter audite le tri des morceaux sans texte : la moitie
+des cases devient un decor sans texte (degrade, formes, hachures) et le
+rapport donne la part de morceaux sautes et la part de bulles qui ne sont
+plus entierement dans un morceau lu (texte manque).
+'''
+import argparse
+import io
+import json
+import platform
+import random
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from manhwa_core import (create_engines, group_records, make_options, prepare_chunks,
+                         recognize_page, recognition_units, PREPROCESS_PROFILES, TEXT_FILTER_SCORE)
+
+KOREAN_LINES = [
+    '환영한다 티렌', '여기는 탐정 사무소란다', '무슨 일이야?', '그럴 리가 없어',
+    '잠깐만 기다려', '정말 고마워요', '어디 가는 거야', '내가 말했잖아',
+    '오늘은 날씨가 좋네', '이건 비밀이야', '다시 한 번 말해 봐', '괜찮아요',
+]
+ENGLISH_LINES = [
+    'WELCOME BACK', 'WHAT HAPPENED?', 'WAIT A SECOND', 'THANK YOU',
+    'WHERE ARE YOU GOING', 'I TOLD YOU', 'THIS IS A SECRET', 'ARE YOU OKAY?',
+]
+
+# Polices avec des glyphes hangul (Windows, Linux, macOS)
+HANGUL_FONTS = [
+    'C:/Windows/Fonts/malgun.ttf',
+    '/usr/share/fonts/truetype/nanum/NanumGothic.ttf',
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/System/Library/Fonts/AppleSDGothicNeo.ttc',
+]
+LATIN_FONTS = [
+    'C:/Windows/Fonts/arial.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+]
+
+PAGE_WIDTH = 800
+FONT_SIZE = 28
+STAGES = ('decode', 'gray', 'clahe', 'denoise', 'split', 'text_score', 'detect', 'recognize', 'retry', 'postprocess',
+          'group', 'docx')
+
+
+def find_font(path=None):
+    '''(police, hangul disponible) ; --font est suppose couvrir le hangul'''
+    if path:
+        return ImageFont.truetype(path, FONT_SIZE), True
+    for candidate in HANGUL_FONTS:
+        if Path(candidate).exists():
+            return ImageFont.truetype(candidate, FONT_SIZE), True
+    for candidate in LATIN_FONTS:
+        if Path(candidate).exists():
+            return ImageFont.truetype(candidate, FONT_SIZE), False
+    return ImageFont.load_default(), False
+
+
+def draw_art(draw, top, bottom, rng):
+    '''Case dessinee sans texte entre les lignes top et bottom'''
+    span = max(1, bottom - top)
+    start, end = rng.randint(120, 250), rng.randint(60, 200)
+    for y in range(top, bottom):
+        shade = start + (end - start) * (y - top) // span
+        draw.line([(0, y), (PAGE_WIDTH, y)], fill=shade)
+    for _ in range(rng.randint(2, 5)):
+        w, h = rng.randint(80, 400), rng.randint(40, max(41, span // 2))
+        x, y = rng.randint(0, PAGE_WIDTH - w), top + rng.randint(0, max(0, span - h))
+        shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+        shape([x, y, x + w, y + h], fill=rng.randint(40, 220), outline=rng.randint(0, 80), width=rng.randint(1, 4))
+    # Quelques traits longs (decor, mouvement)
+    for _ in range(rng.randint(0, 6)):
+        y0, y1 = top + rng.randint(0, span - 1), top + rng.randint(0, span - 1)
+        draw.line([(rng.randint(0, PAGE_WIDTH), y0), (rng.randint(0, PAGE_WIDTH), y1)],
+                  fill=rng.randint(0, 60), width=rng.randint(1, 3))
+
+
+def make_strip(height, density, noise, font, hangul, rng, art=0.0):
+    '''Page synthetique : (octets JPEG, textes des bulles dans l'ordre de lecture,
+    lignes (y, y_end) de chaque bulle)
+
+    density : cases par tranche de 1000 lignes ; noise : ecart-type du bruit
+    gaussien (niveaux de gris) ; art : part des cases dessinees sans texte
+    au lieu d'une bulle.
+    '''
+    img = Image.new('L', (PAGE_WIDTH, height), 255)
+    draw = ImageDraw.Draw(img)
+    lines_pool = (KOREAN_LINES + ENGLISH_LINES) if hangul else ENGLISH_LINES
+
+    truth = []
+    boxes = []
+    count = max(1, round(height / 1000 * density))
+    slot = height / count
+    for i in range(count):
+        if art and rng.random() < art:
+            # Marge blanche : les gouttieres separent encore les cases
+            draw_art(draw, int(i * slot) + 10, int((i + 1) * slot) - 10, rng)
+            continue
+        lines = rng.sample(lines_pool, rng.randint(1, 2))
+        sizes = [draw.textbbox((0, 0), line, font=font) for line in lines]
+        text_w = max(box[2] - box[0] for box in sizes)
+        line_h = FONT_SIZE + 8
+        text_h = line_h * len(lines)
+
+        bubble_w, bubble_h = text_w + 80, text_h + 60
+        if bubble_w >= PAGE_WIDTH - 20 or bubble_h >= slot - 10:
+            continue
+        x = rng.randint(10, PAGE_WIDTH - bubble_w - 10)
+        y = int(i * slot) + rng.randint(5, int(slot - bubble_h - 5))
+
+        draw.ellipse([x, y, x + bubble_w, y + bubble_h], fill=255, outline=0, width=3)
+        for j, (line, box) in enumerate(zip(lines, sizes)):
+            line_x = x + (bubble_w - (box[2] - box[0])) // 2
+            draw.text((line_x, y + 30 + j * line_h), line, fill=0, font=font)
+        truth.append(' '.join(lines))
+        boxes.append((y, y + bubble_h + 1))
+
+    page = np.asarray(img, dtype=np.float32)
+    if noise:
+        page = page + np.random.default_rng(rng.randint(0, 2**31)).normal(0, noise, page.shape)
+    page = np.clip(page, 0, 255).astype(np.uint8)
+    ok, data = cv2.imencode('.jpg', cv2.cvtColor(page, cv2.COLOR_GRAY2BGR), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return data.tobytes(), truth, boxes
+
+
+def missed_text(chunks, boxes):
+    '''Bulles qu'aucun morceau lu ne contient entierement'''
+    kept = [(y, y_end) for _, y, y_end in chunks or []]
+    return sum(1 for top, bottom in boxes if not any(y <= top and bottom <= y_end for y, y_end in kept))
+
+
+def edit_distance(a, b):
+    '''Distance de Levenshtein (deux lignes de la table)'''
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def char_accuracy(predicted, truth):
+    '''1 - distance d'edition / longueur attendue (espaces ignores)'''
+    predicted = ''.join(''.join(predicted).split())
+    truth = ''.join(''.join(truth).split())
+    if not truth:
+        return 1.0 if not predicted else 0.0
+    return max(0.0, 1 - edit_distance(predicted, truth) / len(truth))
+
+
+def peak_rss():
+    '''Pic de memoire du processus en octets (None si inconnu)'''
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+def percentiles(values):
+    if not values:
+        return None
+    arr = np.asarray(values)
+    return {'mean': float(arr.mean()), 'p50': float(np.percentile(arr, 50)),
+            'p90': float(np.percentile(arr, 90)), 'p99': float(np.percentile(arr, 99)),
+            'max': float(arr.max())}
+
+
+def write_docx(bubbles):
+    '''Meme mise en forme que les scripts, dans un fichier en memoire'''
+    from docx import Document
+    from docx.shared import Pt, RGBColor
+
+    doc = Document()
+    doc.add_heading('Page', level=2)
+    for idx, text in enumerate(bubbles, 1):
+        p = doc.add_paragraph()
+        num_run = p.add_run(f'{idx}. ')
+        num_run.bold = True
+        num_run.font.size = Pt(11)
+        text_run = p.add_run(text)
+        text_run.font.color.rgb = RGBColor(0, 0, 255)
+        text_run.font.size = Pt(11)
+    out = io.BytesIO()
+    doc.save(out)
+    return out.tell()
+
+
+def run_page(name, data, truth, boxes, engines, options):
+    '''Toutes les etapes d'une page ; retourne ses mesures'''
+    result, chunks = prepare_chunks(name, options, np.frombuffer(data, dtype=np.uint8),
+                                    units=recognition_units(engines or {}, options))
+    timings = result['timings']
+    # Avant la lecture : les morceaux d'une page lue par bandes sont consommes par l'OCR
+    missed = missed_text(chunks, boxes) if isinstance(chunks, list) else None
+    if chunks is not None and engines:
+        recognize_page(result, chunks, engines)
+
+    start = time.perf_counter()
+    bubbles = [text for text, score in group_records(result['records'])]
+    timings['group'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    write_docx(bubbles)
+    timings['docx'] = time.perf_counter() - start
+
+    return {
+        'name': name,
+        'width': result['width'],
+        'height': result['height'],
+        'chunks': result['chunks'],
+        'chunk_height': result['chunk_height'],
+        'det_scale': result['det_scale'],
+        'bubbles': len(truth),
+        'found': len(bubbles),
+        'accuracy': char_accuracy(bubbles, truth) if engines else None,
+        'timings': timings,
+        'det_area': result['det_area'],
+        'chunk_area': result['chunk_area'],
+        'rec_lines': result['rec_lines'],
+        'retried': result['retried'],
+        'recovered': result['recovered'],
+        'filtered': result['filtered'],
+        'missed_text': missed,
+        'error': result['error'],
+    }
+
+
+def summarize(pages, elapsed):
+    stage_times = {stage: [page['timings'][stage] for page in pages if stage in page['timings']]
+                   for stage in STAGES}
+    accuracies = [page['accuracy'] for page in pages if page['accuracy'] is not None]
+    chunk_area = sum(page['chunk_area'] for page in pages)
+    rec_lines = sum(page['rec_lines'] for page in pages)
+    # Morceaux lus + morceaux sautes par le tri (option text_filter)
+    candidates = sum(page['chunks'] + page['filtered'] for page in pages)
+    audited = [page for page in pages if page['missed_text'] is not None]
+    boxes = sum(page['bubbles'] for page in audited)
+    megapixels = sum(page['width'] * page['height'] for page in pages) / 1e6
+    return {
+        'pages': len(pages),
+        'seconds': elapsed,
+        'pages_per_sec': len(pages) / elapsed if elapsed else None,
+        'stages': {stage: percentiles(times) for stage, times in stage_times.items() if times},
+        'peak_rss': peak_rss(),
+        'char_accuracy': float(np.mean(accuracies)) if accuracies else None,
+        'skipped_area': 1 - sum(page['det_area'] for page in pages) / chunk_area if chunk_area else None,
+        'retried_share': sum(page['retried'] for page in pages) / rec_lines if rec_lines else None,
+        'recovered': sum(page['recovered'] for page in pages),
+        'skip_rate': sum(page['filtered'] for page in pages) / candidates if candidates else None,
+        # Cout du tri rapporte a la surface des pages (millisecondes par megapixel)
+        'text_score_ms_mp': (sum(page['timings'].get('text_score', 0.0) for page in pages) * 1e3
+                             / (megapixels or 1)) if stage_times['text_score'] else None,
+        'missed_text_rate': sum(page['missed_text'] for page in audited) / boxes if boxes else None,
+    }
+
+
+def print_summary(summary):
+    print(f'{summary["pages"]} pages en {summary["seconds"]:.1f}s '
+          f'({summary["pages_per_sec"]:.2f} pages/s)')
+    if summary['char_accuracy'] is not None:
+        print(f'Precision par caractere: {summary["char_accuracy"]:.1%}')
+    if summary.get('skipped_area') is not None:
+        print(f'Surface ignoree par la detection: {summary["skipped_area"]:.0%}')
+    if summary.get('retried_share'):
+        print(f'Deuxieme passe: {summary["retried_share"]:.0%} des lignes relues, '
+              f'{summary["recovered"]} recuperees')
+    if summary.get('skip_rate'):
+        missed = summary['missed_text_rate']
+        print(f'Morceaux sans texte sautes: {summary["skip_rate"]:.0%}, texte manque: '
+              + (f'{missed:.1%} des bulles' if missed is not None else '-')
+              + f', tri {summary["text_score_ms_mp"]:.2f} ms/Mpx')
+    if summary['peak_rss']:
+        print(f'Pic memoire: {summary["peak_rss"] / 2**20:.0f} Mo')
+    print(f'{"etape":<10} {"moy":>8} {"p50":>8} {"p90":>8} {"p99":>8}')
+    for stage, stats in summary['stages'].items():
+        print(f'{stage:<10} ' + ' '.join(f'{stats[k] * 1000:6.1f}ms' for k in ('mean', 'p50', 'p90', 'p99')))
+
+
+def print_tradeoff(runs):
+    '''Une ligne par hauteur de morceau : cout de la detection contre precision'''
+    print(f'\n{"morceaux":<10} {"nb/page":>8} {"echelle":>8} {"pages/s":>8} {"detect p50":>11} {"precision":>10}')
+    for run in runs:
+        summary = run['summary']
+        chunks = np.mean([page['chunks'] for page in run['pages']])
+        scale = min(page['det_scale'] for page in run['pages'])
+        detect = (summary['stages'].get('detect') or {}).get('p50')
+        detect = f'{detect * 1000:.1f}ms' if detect is not None else '-'
+        accuracy = f'{summary["char_accuracy"]:.1%}' if summary['char_accuracy'] is not None else '-'
+        print(f'{run["chunk_height"]:<10} {chunks:>8.1f} {scale:>8.2f} {summary["pages_per_sec"]:>8.2f} '
+              f'{detect:>11} {accuracy:>10}')
+
+
+def compare(old_path, summary):
+    '''Ecart avec un rapport precedent'''
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)['summary']
+    print(f'\nComparaison avec {old_path}:')
+    for key in ('pages_per_sec', 'char_accuracy', 'peak_rss', 'skip_rate', 'missed_text_rate'):
+        before, after = old.get(key), summary.get(key)
+        if before and after is not None:
+            print(f'  {key}: {before:.4g} -> {after:.4g} ({after / before - 1:+.1%})')
+    for stage, stats in summary['stages'].items():
+        before = (old['stages'].get(stage) or {}).get('p50')
+        if before:
+            print(f'  {stage} p50: {before * 1000:.1f}ms -> {stats["p50"] * 1000:.1f}ms '
+                  f'({stats["p50"] / before - 1:+.1%})')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark sur des pages synthetiques')
+    parser.add_argument('--heights', type=int, nargs='+', default=[3000, 8000, 15000],
+                        help='Hauteurs de page (pixels)')
+    parser.add_argument('--densities', type=float, nargs='+', default=[1.0, 3.0],
+                        help='Cases par tranche de 1000 lignes')
+    parser.add_argument('--art', type=float, default=0.0,
+                        help='Part des cases dessinees sans texte (audit de --text-filter)')
+    parser.add_argument('--noise', type=float, nargs='+', default=[0.0, 8.0],
+                        help='Ecart-type du bruit gaussien')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Pages generees par combinaison')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--font', default=None, help='Police TrueType avec hangul')
+    parser.add_argument('--langs', nargs='+', choices=['korean', 'en'], default=['korean'])
+    parser.add_argument('--split-mode', choices=['fixed', 'gutters'], default='gutters')
+    parser.add_argument('--preprocess', choices=sorted(PREPROCESS_PROFILES), default='full')
+    parser.add_argument('--chunk-heights', nargs='+', default=['auto'],
+                        help='Hauteurs de morceau a comparer (auto = deduite du detecteur)')
+    parser.add_argument('--roi', action='store_true',
+                        help='Detection limitee aux bulles (option roi)')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Premiere passe sans pretraitement, lignes peu sures relues (option cascade)')
+    parser.add_argument('--text-filter', type=float, nargs='?', const=TEXT_FILTER_SCORE, default=None,
+                        metavar='SEUIL',
+                        help='Sauter les morceaux sans texte probable (option text_filter) ; '
+                             'rapporte le taux de morceaux sautes et de texte manque')
+    parser.add_argument('--no-ocr', action='store_true',
+                        help='Mesurer seulement le pretraitement, la decoupe et le DOCX')
+    parser.add_argument('--save-pages', default=None,
+                        help='Dossier ou enregistrer les pages generees')
+    parser.add_argument('--output', default=None, help='Rapport JSON (defaut: bench_<date>.json)')
+    parser.add_argument('--compare', default=None, help='Rapport JSON precedent a comparer')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    font, hangul = find_font(args.font)
+    if not hangul:
+        print('Aucune police hangul trouvee (--font) : pages en anglais seulement')
+
+    rng = random.Random(args.seed)
+    pages = []
+    for height in args.heights:
+        for density in args.densities:
+            for noise in args.noise:
+                for i in range(args.repeat):
+                    name = f'h{height}_d{density:g}_n{noise:g}_{i}'
+                    data, truth, boxes = make_strip(height, density, noise, font, hangul, rng, args.art)
+                    pages.append((name, data, truth, boxes))
+                    if args.save_pages:
+                        folder = Path(args.save_pages)
+                        folder.mkdir(parents=True, exist_ok=True)
+                        (folder / f'{name}.jpg').write_bytes(data)
+    print(f'{len(pages)} pages generees')
+
+    engines = None
+    if not args.no_ocr:
+        print('Chargement des moteurs OCR...')
+        engines = create_engines(args.langs)
+
+    runs = []
+    for chunk_height in args.chunk_heights:
+        options = make_options(split_mode=args.split_mode, profile=args.preprocess, roi=args.roi,
+                               cascade=args.cascade, text_filter=args.text_filter,
+                               chunk_height=None if chunk_height == 'auto' else int(chunk_height))
+        print(f'\nMorceaux: {chunk_height}')
+        results = []
+        start = time.perf_counter()
+        for name, data, truth, boxes in pages:
+            page = run_page(name, data, truth, boxes, engines, options)
+            results.append(page)
+            accuracy = '' if page['accuracy'] is None else f', precision {page["accuracy"]:.1%}'
+            filtered = f' (+{page["filtered"]} sautes)' if page['filtered'] else ''
+            print(f'  {name}: {page["chunks"]} morceaux{filtered} de {page["chunk_height"]}px, '
+                  f'{page["found"]}/{page["bubbles"]} bulles{accuracy}')
+        summary = summarize(results, time.perf_counter() - start)
+        print()
+        print_summary(summary)
+        runs.append({'chunk_height': chunk_height, 'options': options, 'summary': summary, 'pages': results})
+
+    if len(runs) > 1:
+        print_tradeoff(runs)
+    options, summary, results = runs[0]['options'], runs[0]['summary'], runs[0]['pages']
+
+    report = {
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'options': options,
+        'hangul_font': hangul,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cv2': cv2.__version__,
+            'numpy': np.__version__,
+        },
+        'summary': summary,
+        'pages': results,
+        'chunk_heights': [{key: run[key] for key in ('chunk_height', 'summary')} for run in runs],
+    }
+    output = Path(args.output or f'bench_{time.strftime("%Y%m%d_%H%M%S")}.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f'\nRapport: {output}')
+
+    if args.compare:
+        compare(args.compare, summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+'''Cache OCR persistant (SQLite), adresse par le contenu des images
+
+La cle combine le hash des octets de l'image et tous les reglages qui
+changent le resultat brut (pretraitement, decoupe, parametres PaddleOCR,
+modeles, langue). On stocke les lignes brutes (texte, score, boite) avant
+filtrage : modifier is_noise ou MIN_SCORE ne vide donc pas le cache.
+'''
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from manhwa_phash import BandIndex
+
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_FILENAME = 'ocr_cache.sqlite'
+
+
+def default_cache_dir():
+    '''Dossier de cache utilisateur (LOCALAPPDATA sous Windows, XDG ailleurs)'''
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = Path.home() / '.cache'
+    return Path(base) / 'manhwa-text-extractor'
+
+
+def default_cache_path():
+    return default_cache_dir() / CACHE_FILENAME
+
+
+def digest_bytes(data):
+    return hashlib.sha256(memoryview(data)).hexdigest()
+
+
+class OcrCache:
+    '''Cache cle -> resultat brut d'une page pour une langue, eviction LRU
+
+    Utilisable depuis plusieurs threads (verrou) et plusieurs processus
+    (SQLite en mode WAL, chaque processus ouvre sa propre connexion).
+    '''
+
+    def __init__(self, path=None, max_bytes=CACHE_MAX_BYTES):
+        self.path = Path(path) if path else default_cache_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            ' key TEXT PRIMARY KEY,'
+            ' value TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' last_used REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_last_used ON pages (last_used)')
+        self._db.commit()
+        # Bandes deja lues, reconnues meme recompressees (option 'phash') ;
+        # elles comptent dans max_bytes avec les pages
+        self.bands = BandIndex(self._db, self._lock, self._evict)
+
+    @staticmethod
+    def key(digest, settings):
+        '''Cle d'une page : hash de l'image + reglages (dict serialisable)'''
+        blob = json.dumps(settings, sort_keys=True, ensure_ascii=True)
+        return hashlib.sha256(f'{digest}:{blob}'.encode('ascii')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT value FROM pages WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE pages SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        blob = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO pages (key, value, size, last_used) VALUES (?, ?, ?, ?)',
+                (key, blob, len(blob.encode('utf-8')), time.time()),
+            )
+            self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        '''Supprime les entrees les moins recemment utilisees au-dela de max_bytes
+
+        Pages et bandes connues partagent le budget ; les bandes 'skip',
+        posees a la main, comptent mais ne sont jamais supprimees ici.
+        '''
+        total = self._db.execute(
+            'SELECT (SELECT COALESCE(SUM(size), 0) FROM pages)'
+            ' + (SELECT COALESCE(SUM(size), 0) FROM bands)').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        rows = self._db.execute(
+            "SELECT 'pages', key, size, last_used FROM pages"
+            " UNION ALL SELECT 'bands', id, size, last_used FROM bands WHERE action = 'reuse'"
+            ' ORDER BY last_used').fetchall()
+        doomed = {'pages': [], 'bands': []}
+        for table, key, size, _ in rows:
+            if excess <= 0:
+                break
+            doomed[table].append((key,))
+            excess -= size
+        self._db.executemany('DELETE FROM pages WHERE key = ?', doomed['pages'])
+        self._db.executemany('DELETE FROM bands WHERE id = ?', doomed['bands'])
+
+    def stats(self):
+        with self._lock:
+            count, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages').fetchone()
+        return {'entries': count, 'bytes': size, 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM pages')
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
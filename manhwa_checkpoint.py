@@ -0,0 +1,150 @@
+'''Reprise des extractions : manifeste de points de controle par chapitre
+
+Chaque page terminee est ajoutee (une ligne JSON) au fichier
+.manhwa_job.jsonl du dossier du chapitre (ou a cote de son archive / PDF,
+voir manhwa_sources.PageSource.job_path), avec son resultat structure.
+Une extraction relancee saute les pages deja faites et reconstruit le
+DOCX a partir du manifeste. Le fichier est en ajout seul : un arret brutal
+perd au pire la ligne en cours d'ecriture.
+'''
+import json
+import os
+from pathlib import Path
+
+from manhwa_sources import page_name, page_stamp
+
+JOB_FILENAME = '.manhwa_job.jsonl'
+JOB_VERSION = 1
+
+
+class ChapterJob:
+    '''Manifeste d'une extraction de chapitre
+
+    settings : dict serialisable des reglages (langues, decoupe, OCR) ; si
+    ils changent, les points de controle existants sont ignores.
+    images : chemins ou references de pages (manhwa_sources) ; path :
+    fichier du manifeste (defaut : JOB_FILENAME dans folder).
+    '''
+
+    def __init__(self, folder, images, settings, path=None):
+        self.folder = Path(folder)
+        self.path = self.manifest_path(folder, path)
+        self.images = [str(p) for p in images]
+        self.settings = settings
+
+        self.done, stale = self.load_manifest(self.path, self.images, settings)
+        if not self.done:
+            self._start()
+        elif stale:
+            # Pages modifiees ou ligne tronquee : on reecrit un manifeste propre
+            self._start(keep=True)
+
+    @staticmethod
+    def manifest_path(folder, path=None):
+        '''Fichier du manifeste : path, ou JOB_FILENAME dans folder'''
+        return Path(path) if path is not None else Path(folder) / JOB_FILENAME
+
+    @staticmethod
+    def _make_header(images, settings):
+        return {'type': 'job', 'version': JOB_VERSION, 'settings': settings,
+                'pages': [page_name(p) for p in images]}
+
+    def _header(self):
+        return self._make_header(self.images, self.settings)
+
+    @staticmethod
+    def load_manifest(path, images, settings):
+        '''Pages terminees d'un manifeste compatible, sans rien ecrire
+
+        Retourne (done, stale) : done {indice dans images: resultat} ; stale
+        vrai si le fichier merite d'etre reecrit (ligne tronquee, liste de
+        pages changee). Sert aussi a savoir si un chapitre est a jour.
+        '''
+        path = Path(path)
+        if not path.exists():
+            return {}, False
+
+        with open(path, encoding='utf-8') as f:
+            lines = f.readlines()
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return {}, False
+        images = [str(p) for p in images]
+        expected = json.loads(json.dumps(ChapterJob._make_header(images, settings)))
+        if header.get('version') != JOB_VERSION or header.get('settings') != expected['settings']:
+            return {}, False
+
+        names = {page_name(p): i for i, p in enumerate(images)}
+        done = {}
+        truncated = False
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Derniere ligne tronquee par un arret brutal
+                truncated = True
+                continue
+            if entry.get('type') != 'page':
+                continue
+            idx = names.get(entry['name'])
+            if idx is None:
+                continue
+            try:
+                if entry['stamp'] != page_stamp(images[idx]):
+                    continue
+            except OSError:
+                continue
+            done[idx] = entry['result']
+
+        return done, truncated or header.get('pages') != expected['pages']
+
+    def _start(self, keep=False):
+        '''Nouveau manifeste (en gardant les pages deja valides si keep)'''
+        tmp = self.path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self._header(), ensure_ascii=False) + '\n')
+            if keep:
+                for idx, result in sorted(self.done.items()):
+                    f.write(self._entry(idx, result) + '\n')
+        os.replace(tmp, self.path)
+
+    def _entry(self, idx, result):
+        path = self.images[idx]
+        # La trace ne concerne que le lancement qui l'a produite
+        result = {k: v for k, v in result.items() if k != 'trace'}
+        return json.dumps({'type': 'page', 'name': page_name(path), 'stamp': page_stamp(path),
+                           'result': result}, ensure_ascii=False)
+
+    def reset(self):
+        '''Oublie les pages deja faites (extraction depuis le debut)'''
+        self.done = {}
+        self._start()
+
+    def pending(self):
+        '''Pages restant a extraire, dans l'ordre'''
+        return [p for i, p in enumerate(self.images) if i not in self.done]
+
+    def record(self, idx, result):
+        '''Ajoute une page terminee au manifeste (ecrit tout de suite sur disque)'''
+        self.done[idx] = result
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(self._entry(idx, result) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def iter_results(self, fresh):
+        '''Resultats de toutes les pages dans l'ordre
+
+        fresh : iterateur des resultats des pages de pending(), dans l'ordre.
+        Les pages en erreur ne sont pas enregistrees et seront retentees.
+        '''
+        for idx in range(len(self.images)):
+            if idx in self.done:
+                yield self.done[idx]
+                continue
+            result = next(fresh)
+            if not result['error']:
+                self.record(idx, result)
+            yield result
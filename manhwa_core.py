@@ -0,0 +1,1406 @@
+'''Fonctions OCR partagees par les scripts CLI et la GUI'''
+import functools
+import itertools
+import re
+import time
+
+import cv2
+import numpy as np
+
+from manhwa_cache import OcrCache, digest_bytes
+from manhwa_phash import (band_signature, ASPECT_TOLERANCE, BAND_MIN_HEIGHT, DHASH_MAX_DISTANCE, DHASH_SIZE,
+                          THUMB_MAX_DIFF)
+from manhwa_sources import read_page, split_ref
+from manhwa_tiles import PngRowReader, png_info
+from manhwa_trace import trace_event
+
+# Hauteur par defaut des fonctions de bas niveau ; l'extraction la deduit
+# de la page (chunk_geometry)
+CHUNK_HEIGHT = 3000
+OVERLAP = 200
+MIN_SCORE = 0.70
+
+# Profils de pretraitement. 'auto' estime le bruit de chaque bande de
+# chunk_height lignes et ne debruite que celles qui depassent noise_sigma.
+CLAHE_GRID = 8
+PREPROCESS_PROFILES = {
+    'none': {'clahe_clip': None, 'denoise_h': None},
+    'clahe': {'clahe_clip': 1.5, 'denoise_h': None},
+    'full': {'clahe_clip': 1.5, 'denoise_h': 7},
+    'heavy': {'clahe_clip': 2.5, 'denoise_h': 12},
+    'auto': {'clahe_clip': 1.5, 'denoise_h': 7, 'noise_sigma': 3.0},
+}
+
+# Cascade (option 'cascade') : pages lues sans pretraitement, puis seules
+# les lignes dont le score tombe dans CASCADE_BAND sont recadrees avec une
+# marge de CASCADE_PAD hauteurs de ligne, agrandies, pretraitees avec
+# CASCADE_PROFILE et relues. Sous la bande, la boite n'est presque jamais du
+# texte ; au-dessus, la premiere lecture est sure.
+CASCADE_FIRST_PROFILE = 'none'
+CASCADE_PROFILE = 'heavy'
+CASCADE_BAND = (0.3, 0.85)
+CASCADE_UPSCALE = 2.0
+CASCADE_PAD = 0.15
+
+# Tri des morceaux avant pretraitement (option 'text_filter', voir
+# text_score) : contours forts (gradient morphologique > TEXT_EDGE_CONTRAST)
+# sur la page reduite TEXT_SCALE fois, densite par case de TEXT_CELL px
+# dans TEXT_DENSITY, cases voisines regroupees en composantes ; une ligne de
+# texte donne une composante pleine et plus large que haute.
+TEXT_SCALE = 2
+TEXT_EDGE_CONTRAST = 48
+TEXT_CELL = 8
+TEXT_DENSITY = (0.06, 0.75)
+TEXT_MIN_FILL = 0.2
+# Seuil par defaut : ne saute que les morceaux sans aucun trait groupe
+# (aplats, degrades, decors flous)
+TEXT_FILTER_SCORE = 2
+
+# Reglages d'une extraction, transmis tels quels aux processus du pool
+DEFAULT_OPTIONS = {
+    'split_mode': 'fixed',
+    'profile': 'full',
+    'bilingual': 'shared',
+    # Evenements detailles dans result['trace'] (voir manhwa_trace)
+    'trace': False,
+    # Detection limitee aux bulles / cartouches trouves par find_bubble_rois
+    'roi': False,
+    # Hauteur des morceaux ; None : deduite de la largeur de la page et des
+    # limites d'entree du detecteur (voir chunk_geometry)
+    'chunk_height': None,
+    # Lecture par bandes des PNG (voir TiledChunks) : None = seulement les
+    # pages d'au moins TILED_MIN_HEIGHT lignes, True = toujours, False = jamais
+    'tiled': None,
+    # Bandes deja lues dans un autre chapitre reprises de l'index perceptuel
+    # du cache (voir manhwa_phash) au lieu d'etre relues
+    'phash': False,
+    # Premiere passe sans pretraitement, lignes peu sures relues (CASCADE_*)
+    'cascade': False,
+    # Score minimal (text_score) d'un morceau pour etre pretraite et lu ;
+    # None : tous les morceaux sont lus
+    'text_filter': None,
+}
+
+# Plusieurs langues : 'shared' detecte une seule fois et choisit le
+# reconnaisseur par boite, 'separate' fait une passe complete par langue
+BILINGUAL_MODES = ('shared', 'separate')
+
+# Decoupage sur les gouttieres (mode 'gutters')
+BLANK_TOLERANCE = 12
+# Lignes testees sur la page moyennee par GUTTER_BLUR x GUTTER_BLUR px ;
+# la tolerance grandit de GUTTER_NOISE fois le bruit mesure (scan, JPEG)
+GUTTER_BLUR = 5
+GUTTER_NOISE = 1.5
+MIN_GUTTER = 60
+GUTTER_MARGIN = 16
+
+# Fusion des morceaux : une boite a moins de EDGE_MARGIN px du bas du
+# morceau precedent peut y avoir ete coupee, elle est donc relue
+EDGE_MARGIN = 4
+DEDUP_IOU = 0.5
+DEDUP_CONTAIN = 0.8
+
+# Regroupement en bulles : deux lignes sont dans la meme bulle si l'ecart
+# vertical (lignes empilees) ou horizontal (meme ligne) ne depasse pas
+# BUBBLE_GAP_Y / BUBBLE_GAP_X fois la hauteur de la plus petite ligne
+BUBBLE_GAP_X = 1.0
+BUBBLE_GAP_Y = 0.8
+BUBBLE_GRID_CELL = 128
+
+# Zones candidates (option 'roi') : interieurs clairs et fermes (bulles,
+# cartouches) contenant un peu d'encre ; le reste du morceau n'est pas
+# envoye au detecteur
+ROI_BRIGHT = 200
+ROI_MIN_AREA = 1500
+ROI_MAX_FRACTION = 0.5
+ROI_MIN_FILL = 0.4
+ROI_INK = (0.005, 0.5)
+ROI_PAD = 12
+# Les zones d'un morceau sont rangees sur des planches blanches pour un seul
+# appel au detecteur, separees par ROI_GAP pixels de blanc
+ROI_GAP = 32
+
+OCR_PARAMS = {
+    'use_textline_orientation': True,
+    'text_det_thresh': 0.25,
+    'text_det_box_thresh': 0.55,
+    'text_det_unclip_ratio': 1.6,
+    'text_det_limit_side_len': 64,
+    'text_det_limit_type': 'min',
+}
+
+# Le detecteur redimensionne son entree : limit_type 'min' agrandit les
+# images dont le petit cote est sous limit_side_len, 'max' reduit celles dont
+# le grand cote le depasse, et dans tous les cas PaddleOCR reduit toute image
+# dont un cote depasse DET_MAX_SIDE (max_side_limit). Les dimensions sont
+# ensuite arrondies a un multiple de DET_STRIDE.
+DET_MAX_SIDE = 4000
+DET_STRIDE = 32
+MIN_CHUNK_HEIGHT = 512
+
+# Au-dela, une page PNG n'est plus decodee d'un bloc mais morceau par morceau
+TILED_MIN_HEIGHT = 20000
+
+# Memes modeles que PaddleOCR(lang=...) en PP-OCRv5
+DET_MODEL = 'PP-OCRv5_server_det'
+REC_MODELS = {
+    'korean': 'korean_PP-OCRv5_mobile_rec',
+    'en': 'en_PP-OCRv5_mobile_rec',
+}
+ORI_MODEL = 'PP-LCNet_x1_0_textline_ori'
+REC_BATCH_SIZE = 8
+# Lots de reconnaissance quand les lignes de plusieurs pages sont regroupees
+REC_BATCH_LARGE = 48
+
+# Aiguillage bilingue : une ligne lue par la premiere langue n'est relue par
+# les autres que si elle n'est pas dans son ecriture ou peu confiante
+LANG_SCRIPTS = {
+    'korean': re.compile(r'[\uac00-\ud7a3\u1100-\u11ff\u3130-\u318f]'),
+    'en': re.compile(r'[A-Za-z]'),
+}
+SECOND_OPINION_SCORE = 0.90
+
+
+class ExtractionCancelled(Exception):
+    '''Levee par un rappel de progression pour arreter l'OCR au morceau suivant'''
+
+
+class OcrEngine:
+    '''Detection et reconnaissance separees (modeles PaddleOCR)
+
+    Permet de choisir quelles boites sont envoyees a la reconnaissance
+    au lieu de tout relire a chaque appel de PaddleOCR.predict.
+    '''
+
+    def __init__(self, lang='korean', cpu_threads=None, det=None):
+        from paddleocr import TextDetection, TextRecognition, TextLineOrientationClassification
+
+        # cpu_threads limite les threads Paddle (utile avec plusieurs processus)
+        common = {} if cpu_threads is None else {'cpu_threads': cpu_threads}
+
+        # det : detecteur d'un autre moteur (meme modele quelle que soit la langue)
+        self.lang = lang
+        self.det = det or TextDetection(
+            **common,
+            model_name=DET_MODEL,
+            limit_side_len=OCR_PARAMS['text_det_limit_side_len'],
+            limit_type=OCR_PARAMS['text_det_limit_type'],
+            thresh=OCR_PARAMS['text_det_thresh'],
+            box_thresh=OCR_PARAMS['text_det_box_thresh'],
+            unclip_ratio=OCR_PARAMS['text_det_unclip_ratio'],
+        )
+        self.rec = TextRecognition(model_name=REC_MODELS[lang], **common)
+        self.ori = None
+        if OCR_PARAMS['use_textline_orientation']:
+            self.ori = TextLineOrientationClassification(model_name=ORI_MODEL, **common)
+
+    def detect(self, img):
+        '''Polygones (4 points) des lignes de texte, dans le repere de img'''
+        result = self.det.predict(img)
+        if not result:
+            return []
+        return [np.asarray(poly, dtype=np.float32) for poly in result[0]['dt_polys']]
+
+    def detect_many(self, imgs):
+        '''detect() de plusieurs images, un appel au detecteur par taille
+
+        Le detecteur empile les images d'un lot (np.stack) : seules les
+        images de meme forme peuvent partager un appel.
+        '''
+        by_shape = {}
+        for i, img in enumerate(imgs):
+            by_shape.setdefault(img.shape, []).append(i)
+        polys = [None] * len(imgs)
+        for indices in by_shape.values():
+            results = self.det.predict([imgs[i] for i in indices], batch_size=len(indices))
+            for i, res in zip(indices, results):
+                polys[i] = [np.asarray(poly, dtype=np.float32) for poly in res['dt_polys']]
+        return polys
+
+    def recognize(self, crops, batch_size=REC_BATCH_SIZE, bucket=False):
+        '''Lit une liste de crops, retourne [(texte, score)] dans le meme ordre
+
+        bucket=True trie d'abord les crops par format (largeur / hauteur) pour
+        que chaque lot contienne des lignes de longueur proche et que le
+        padding a la plus longue ligne du lot reste faible.
+        '''
+        if not crops:
+            return []
+
+        order = list(range(len(crops)))
+        if bucket:
+            order.sort(key=lambda i: crops[i].shape[1] / max(crops[i].shape[0], 1))
+            crops = [crops[i] for i in order]
+
+        if self.ori is not None:
+            labels = self.ori.predict(crops, batch_size=batch_size)
+            crops = [cv2.rotate(crop, cv2.ROTATE_180) if res['label_names'][0] == '180_degree' else crop
+                     for crop, res in zip(crops, labels)]
+
+        texts = [(res['rec_text'], float(res['rec_score']))
+                 for res in self.rec.predict(crops, batch_size=batch_size)]
+
+        # Remise dans l'ordre d'origine
+        results = [None] * len(texts)
+        for i, text in zip(order, texts):
+            results[i] = text
+        return results
+
+
+def create_ocr(lang='korean', cpu_threads=None, det=None):
+    '''Charge un moteur OCR avec les reglages du projet'''
+    return OcrEngine(lang, cpu_threads, det)
+
+
+def create_engines(langs, cpu_threads=None):
+    '''Un moteur par langue, dans l'ordre demande, avec un seul detecteur'''
+    engines = {}
+    for lang in langs:
+        det = next(iter(engines.values())).det if engines else None
+        engines[lang] = create_ocr(lang, cpu_threads, det)
+    return engines
+
+
+def read_bytes(img_path):
+    '''Lit le fichier brut (etape I/O, sans decodage)
+
+    img_path peut aussi etre une page d'archive ou de PDF (voir manhwa_sources).
+    '''
+    if split_ref(img_path)[1] is not None:
+        data = read_page(img_path)
+        return None if not data else np.frombuffer(data, dtype=np.uint8)
+    try:
+        data = np.fromfile(str(img_path), dtype=np.uint8)
+    except OSError:
+        return None
+    if data.size == 0:
+        return None
+    return data
+
+
+def decode_image(data):
+    if data is None:
+        return None
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def make_options(**overrides):
+    '''Reglages d'extraction : DEFAULT_OPTIONS + valeurs donnees'''
+    unknown = set(overrides) - set(DEFAULT_OPTIONS)
+    if unknown:
+        raise ValueError(f'Options inconnues: {", ".join(sorted(unknown))}')
+    options = dict(DEFAULT_OPTIONS)
+    options.update({k: v for k, v in overrides.items() if v is not None})
+    if options['profile'] not in PREPROCESS_PROFILES:
+        raise ValueError(f'Profil de pretraitement inconnu: {options["profile"]}')
+    if options['bilingual'] not in BILINGUAL_MODES:
+        raise ValueError(f'Mode bilingue inconnu: {options["bilingual"]}')
+    if options['text_filter'] is not None and options['text_filter'] < 0:
+        raise ValueError(f'Seuil de tri negatif: {options["text_filter"]}')
+    if options['chunk_height'] is not None and options['chunk_height'] <= 2 * OVERLAP:
+        raise ValueError(f'Hauteur de morceau trop petite: {options["chunk_height"]} (minimum {2 * OVERLAP + 1})')
+    return options
+
+
+def page_profile(options):
+    '''Pretraitement applique aux pages (minimal en cascade)'''
+    return CASCADE_FIRST_PROFILE if options['cascade'] else options['profile']
+
+
+def _add_time(timings, step, start, trace=None, **args):
+    '''Cumule la duree d'une etape ; trace : liste d'evenements (ou None)'''
+    elapsed = time.perf_counter() - start
+    if timings is not None:
+        timings[step] = timings.get(step, 0.0) + elapsed
+    if trace is not None:
+        trace.append(trace_event(step, elapsed, **args))
+
+
+def estimate_noise(gray):
+    '''Ecart-type du bruit (methode d'Immerkaer) : un filtre 3x3 et une somme'''
+    h, w = gray.shape[:2]
+    if h < 3 or w < 3:
+        return 0.0
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+    response = cv2.filter2D(gray, cv2.CV_32F, kernel, borderType=cv2.BORDER_REFLECT)
+    total = float(np.abs(response[1:-1, 1:-1]).sum())
+    return total * np.sqrt(np.pi / 2) / (6 * (w - 2) * (h - 2))
+
+
+def _denoise_bands(gray, enhanced, h_value, sigma, chunk_height, stats):
+    '''Debruite seulement les bandes de chunk_height lignes jugees bruitees'''
+    # Marge pour que la fenetre de recherche NL-means (21 px) ne cree pas de couture
+    margin = 16
+    out = enhanced
+    height = gray.shape[0]
+
+    for y in range(0, height, chunk_height):
+        y_end = min(y + chunk_height, height)
+        stats['bands'] += 1
+        if estimate_noise(gray[y:y_end]) <= sigma:
+            continue
+        stats['denoised_bands'] += 1
+        top, bottom = max(0, y - margin), min(height, y_end + margin)
+        band = cv2.fastNlMeansDenoising(enhanced[top:bottom], h=h_value)
+        if out is enhanced:
+            out = enhanced.copy()
+        out[y:y_end] = band[y - top:y - top + (y_end - y)]
+
+    return out
+
+
+def light_preprocess(img, chunk_height=CHUNK_HEIGHT, profile='full', timings=None, stats=None,
+                     trace=None):
+    '''Pretraitement leger - amelioration contraste + debruitage
+
+    Applique sur la page entiere : la grille CLAHE est etiree en hauteur
+    pour garder des tuiles de la meme taille qu'un morceau de chunk_height.
+    profile : cle de PREPROCESS_PROFILES. timings recoit le temps par etape,
+    stats le nombre de bandes debruitees en mode 'auto', trace les evenements.
+    '''
+    if img is None:
+        return None
+
+    params = PREPROCESS_PROFILES[profile]
+    if stats is None:
+        stats = {}
+    stats.setdefault('bands', 0)
+    stats.setdefault('denoised_bands', 0)
+
+    start = time.perf_counter()
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _add_time(timings, 'gray', start, trace)
+
+    enhanced = gray
+    if params['clahe_clip'] is not None:
+        start = time.perf_counter()
+        rows = max(CLAHE_GRID, -(-CLAHE_GRID * gray.shape[0] // chunk_height))
+        clahe = cv2.createCLAHE(clipLimit=params['clahe_clip'], tileGridSize=(CLAHE_GRID, rows))
+        enhanced = clahe.apply(gray)
+        _add_time(timings, 'clahe', start, trace)
+
+    if params['denoise_h'] is None:
+        return enhanced
+
+    start = time.perf_counter()
+    if 'noise_sigma' in params:
+        denoised = _denoise_bands(gray, enhanced, params['denoise_h'], params['noise_sigma'],
+                                  chunk_height, stats)
+    else:
+        denoised = cv2.fastNlMeansDenoising(enhanced, h=params['denoise_h'])
+        stats['bands'] += 1
+        stats['denoised_bands'] += 1
+    _add_time(timings, 'denoise', start, trace, bands=stats['denoised_bands'])
+
+    return denoised
+
+
+def prepare_page(img, chunk_height=CHUNK_HEIGHT, profile='full', timings=None, stats=None,
+                 trace=None):
+    '''Pretraite une page et la remet en 3 canaux pour PaddleOCR'''
+    preprocessed = light_preprocess(img, chunk_height, profile, timings, stats, trace)
+    if preprocessed is None:
+        return None
+    return cv2.cvtColor(preprocessed, cv2.COLOR_GRAY2BGR)
+
+
+def det_input_scale(height, width, params=OCR_PARAMS):
+    '''Facteur applique par le detecteur a une image height x width'''
+    limit = params['text_det_limit_side_len']
+    if params['text_det_limit_type'] == 'max':
+        scale = min(1.0, limit / max(height, width))
+    else:
+        scale = max(1.0, limit / min(height, width))
+    if max(height, width) * scale > DET_MAX_SIDE:
+        scale = DET_MAX_SIDE / max(height, width)
+    return scale
+
+
+def chunk_geometry(width, options=None, params=OCR_PARAMS):
+    '''(hauteur des morceaux, recouvrement) pour une page de cette largeur
+
+    Le moins de morceaux possible sans que le detecteur ne les reduise :
+    la hauteur est le plus grand cote accepte tel quel (DET_MAX_SIDE, ou
+    limit_side_len en mode 'max'), arrondi a DET_STRIDE. Une page plus large
+    que ce cote sera reduite de toute facon ; des morceaux carres gardent
+    alors le meme facteur avec le moins de morceaux. options['chunk_height']
+    impose une hauteur fixe.
+    '''
+    options = options or DEFAULT_OPTIONS
+    if options.get('chunk_height'):
+        return options['chunk_height'], OVERLAP
+
+    side = DET_MAX_SIDE
+    if params['text_det_limit_type'] == 'max':
+        side = min(side, params['text_det_limit_side_len'])
+    height = max(MIN_CHUNK_HEIGHT, max(side, width) // DET_STRIDE * DET_STRIDE)
+    return height, min(OVERLAP, height // 4)
+
+
+def _fixed_spans(start, end, chunk_height, overlap):
+    '''Intervalles [y, y_end) de chunk_height px avec recouvrement'''
+    spans = []
+    for y in range(start, end, chunk_height - overlap):
+        y_end = min(y + chunk_height, end)
+        spans.append((y, y_end))
+        if y_end == end:
+            break
+    return spans
+
+
+def _runs(mask):
+    '''Debuts et fins (exclues) des sequences de True d'un masque 1-D'''
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges[0::2], edges[1::2]
+
+
+def sample_noise(gray, bands=8, rows=128):
+    '''estimate_noise sur quelques bandes reparties sur la page (mediane)
+
+    Bien moins cher que sur toute une longue page, et une bande de dessin
+    ou de texte ne fausse pas le resultat.
+    '''
+    h = gray.shape[0]
+    if h <= bands * rows:
+        return estimate_noise(gray)
+    starts = np.linspace(0, h - rows, bands).astype(int)
+    return float(np.median([estimate_noise(gray[y:y + rows]) for y in starts]))
+
+
+def blank_rows(page, tolerance=BLANK_TOLERANCE):
+    '''Profil de la page : True pour chaque ligne unie (blanc, noir, aplat)
+
+    L'ecart max - min de chaque ligne est pris sur la page legerement
+    floutee et compare a tolerance elargie selon le bruit : le grain d'un
+    scan ou d'un JPEG ne suffit pas a rendre une gouttiere "pleine".
+    '''
+    gray = page if page.ndim == 2 else page[:, :, 0]
+    tolerance = tolerance + GUTTER_NOISE * sample_noise(gray)
+    smooth = cv2.blur(gray, (GUTTER_BLUR, GUTTER_BLUR))
+    return (smooth.max(axis=1) - smooth.min(axis=1)) <= tolerance
+
+
+def find_content_spans(page, min_gutter=MIN_GUTTER, tolerance=BLANK_TOLERANCE, margin=GUTTER_MARGIN):
+    '''Zones de contenu separees par des gouttieres d'au moins min_gutter lignes
+
+    Les lignes vides en haut et en bas de page sont toujours ignorees. Chaque
+    zone garde jusqu'a margin lignes de gouttiere autour d'elle pour le detecteur.
+    '''
+    h = page.shape[0]
+    starts, ends = _runs(blank_rows(page, tolerance))
+
+    gutters = [(s, e) for s, e in zip(starts.tolist(), ends.tolist())
+               if e - s >= min_gutter or s == 0 or e == h]
+
+    spans = []
+    y = 0
+    for g_start, g_end in gutters:
+        if g_start > y:
+            spans.append((y, g_start))
+        y = g_end
+    if y < h:
+        spans.append((y, h))
+
+    margin = min(margin, min_gutter // 2)
+    return [(max(0, s - margin), min(h, e + margin)) for s, e in spans]
+
+
+def text_score(gray):
+    '''Indice de presence de texte d'un morceau en niveaux de gris (0 : aucun)
+
+    Taille, en cases de TEXT_CELL px, de la plus grande composante de cases
+    a densite de contours "ecriture" qui soit au moins aussi large que haute
+    et assez pleine. Aplats et degrades donnent 0 ; le trait d'un dessin
+    peut donner un petit score, d'ou un seuil reglable. Tout est vectorise
+    (reduction, gradient, moyenne par case) : ~0.4 ms par megapixel
+    (manhwa_bench.py --text-filter affiche le cout mesure).
+    '''
+    h, w = gray.shape[:2]
+    h, w = h - h % TEXT_SCALE, w - w % TEXT_SCALE
+    if not h or not w:
+        return 0
+    # Rapport entier exact : INTER_AREA prend son chemin rapide (5 a 10 fois moins cher)
+    small = cv2.resize(gray[:h, :w], (w // TEXT_SCALE, h // TEXT_SCALE), interpolation=cv2.INTER_AREA)
+    gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3)))
+    _, edges = cv2.threshold(gradient, TEXT_EDGE_CONTRAST, 255, cv2.THRESH_BINARY)
+
+    rows, cols = edges.shape[0] // TEXT_CELL, edges.shape[1] // TEXT_CELL
+    if not rows or not cols:
+        return 0
+    density = cv2.resize(edges[:rows * TEXT_CELL, :cols * TEXT_CELL], (cols, rows), interpolation=cv2.INTER_AREA)
+    cells = ((density >= TEXT_DENSITY[0] * 255) & (density <= TEXT_DENSITY[1] * 255)).astype(np.uint8)
+
+    _, _, stats, _ = cv2.connectedComponentsWithStats(cells, connectivity=8)
+    widths, heights, areas = (stats[1:, k] for k in (cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT, cv2.CC_STAT_AREA))
+    lines = (widths >= 2) & (widths >= heights) & (areas >= TEXT_MIN_FILL * widths * heights)
+    return int(areas[lines].max()) if lines.any() else 0
+
+
+def keep_text_spans(gray, spans, threshold, result, y_offset=0):
+    '''Intervalles [y, y_end) de gray dont text_score atteint threshold
+
+    Les autres sont comptes dans result['filtered'] et ne seront ni
+    pretraites ni lus.
+    '''
+    kept = []
+    for y, y_end in spans:
+        start = time.perf_counter()
+        score = text_score(gray[y:y_end])
+        _add_time(result['timings'], 'text_score', start, result['trace'], y=y + y_offset, score=score)
+        if score >= threshold:
+            kept.append((y, y_end))
+        else:
+            result['filtered'] += 1
+    return kept
+
+
+def filter_chunks(img, chunk_height, overlap, options, result, stats=None):
+    '''Comme prepare_page + split_long_image, sans pretraiter les morceaux sans texte
+
+    La decoupe (gouttieres comprises) se fait sur la page en niveaux de gris
+    brute ; chaque morceau garde par keep_text_spans est ensuite pretraite
+    seul (les recouvrements le sont deux fois).
+    '''
+    timings, trace = result['timings'], result['trace']
+    start = time.perf_counter()
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    spans = [(y, y_end) for _, y, y_end in split_long_image(gray, chunk_height, overlap, options['split_mode'])]
+    _add_time(timings, 'split', start, trace, chunks=len(spans))
+
+    return [(prepare_page(img[y:y_end], chunk_height, page_profile(options), timings, stats, trace), y, y_end)
+            for y, y_end in keep_text_spans(gray, spans, options['text_filter'], result)]
+
+
+def split_long_image(page, chunk_height=CHUNK_HEIGHT, overlap=OVERLAP, mode='fixed'):
+    '''Decoupe une page en vues (sans copie) d'au plus chunk_height px
+
+    mode='fixed'   : morceaux reguliers avec recouvrement, comme avant.
+    mode='gutters' : coupe uniquement dans les gouttieres unies et ne garde
+                     pas les bandes vides ; une zone de contenu plus haute
+                     que chunk_height est redecoupee avec recouvrement.
+
+    Retourne une liste de (morceau, y_start, y_end) en coordonnees page.
+    '''
+    if page is None:
+        return []
+
+    h = page.shape[0]
+    if mode == 'fixed':
+        spans = _fixed_spans(0, h, chunk_height, overlap)
+    elif mode == 'gutters':
+        spans = []
+        for start, end in find_content_spans(page):
+            spans.extend(_fixed_spans(start, end, chunk_height, overlap))
+    else:
+        raise ValueError(f'Mode de decoupage inconnu: {mode}')
+
+    return [(page[y:y_end], y, y_end) for y, y_end in spans]
+
+
+class TiledChunks:
+    '''Morceaux d'une longue page PNG, decodes et pretraites a la demande
+
+    S'utilise comme la liste de split_long_image : (morceau, y_start, y_end)
+    en coordonnees page. Seuls le morceau courant et son recouvrement sont
+    en memoire ; chaque parcours relit la page depuis les octets compresses.
+    En mode 'gutters', les gouttieres sont cherchees dans chaque morceau.
+    Avec l'option 'text_filter', gouttieres et tri (keep_text_spans) se font
+    sur la bande brute, pretraitee seulement si elle garde un morceau. Les
+    champs de result (chunks, skipped_rows, bandes...) sont remplis au fil
+    du parcours.
+    '''
+
+    def __init__(self, data, result, chunk_height, overlap):
+        self.data = data
+        self.result = result
+        self.chunk_height = chunk_height
+        self.overlap = overlap
+
+    def __iter__(self):
+        result = self.result
+        options, timings, trace = result['options'], result['timings'], result['trace']
+        w, h = result['width'], result['height']
+        reader = PngRowReader(self.data)
+        stats = {}
+        # Lignes lues = union des intervalles rendus (croissants)
+        count = covered = covered_until = 0
+        result['det_scale'] = 1.0
+
+        tail = None
+        y = 0
+        while y < h:
+            start = time.perf_counter()
+            band = reader.read(self.chunk_height if tail is None else self.chunk_height - self.overlap)
+            raw = band if tail is None else np.concatenate((tail, band))
+            _add_time(timings, 'decode', start, trace)
+            y_end = y + raw.shape[0]
+            tail = raw[-self.overlap:] if y_end < h else None
+
+            spans = [(0, y_end - y)]
+            text_filter = options['text_filter']
+            if text_filter is not None:
+                gray = raw if raw.ndim == 2 else cv2.cvtColor(raw, cv2.COLOR_BGR2GRAY)
+                if options['split_mode'] == 'gutters':
+                    spans = find_content_spans(gray)
+                spans = keep_text_spans(gray, spans, text_filter, result, y)
+                del gray
+            if spans:
+                page = prepare_page(raw, self.chunk_height, page_profile(options), timings, stats, trace)
+                if options['split_mode'] == 'gutters' and text_filter is None:
+                    spans = find_content_spans(page)
+            del raw, band
+
+            for s, e in spans:
+                covered += max(0, y + e - max(y + s, covered_until))
+                covered_until = max(covered_until, y + e)
+                count += 1
+                result['chunks'] = count
+                result['skipped_rows'] = h - covered
+                result['bands'], result['denoised_bands'] = stats['bands'], stats['denoised_bands']
+                result['det_scale'] = min(result['det_scale'], det_input_scale(e - s, w))
+                yield page[s:e], y + s, y + e
+            y = y_end - self.overlap if tail is not None else y_end
+        result['skipped_rows'] = h - covered
+
+
+def count_skipped_rows(chunks, height):
+    '''Nombre de lignes de la page qui ne passent jamais par l'OCR'''
+    covered = np.zeros(height, dtype=bool)
+    for _, y_start, y_end in chunks:
+        covered[y_start:y_end] = True
+    return int(height - covered.sum())
+
+
+def smart_postprocess(text):
+    text = re.sub(r'\s{2,}', ' ', text)
+    return text.strip()
+
+
+def is_noise(text):
+    text = text.strip()
+    if len(text) < 2:
+        return True
+
+    if re.match(r'^[0-9<>|\.\-_~*:\'"`]+$', text):
+        return True
+
+    noise_patterns = ['UU', 'Mdo', '00000', '|0', '::', 'H']
+    if text in noise_patterns:
+        return True
+
+    return False
+
+
+def is_kept(text, score, min_score=MIN_SCORE):
+    return score > min_score and bool(text.strip()) and not is_noise(text)
+
+
+def crop_box(img, poly):
+    '''Redresse le quadrilatere poly de img (comme get_rotate_crop_image)'''
+    pts = np.asarray(poly, dtype=np.float32)
+    w = int(max(np.linalg.norm(pts[0] - pts[1]), np.linalg.norm(pts[2] - pts[3])))
+    h = int(max(np.linalg.norm(pts[0] - pts[3]), np.linalg.norm(pts[1] - pts[2])))
+    w, h = max(w, 1), max(h, 1)
+
+    dst = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    matrix = cv2.getPerspectiveTransform(pts, dst)
+    crop = cv2.warpPerspective(img, matrix, (w, h), borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+
+    # Ligne verticale : on la couche pour le reconnaisseur
+    if h / w >= 1.5:
+        crop = np.rot90(crop)
+    return crop
+
+
+def pad_poly(poly, pad=CASCADE_PAD):
+    '''Quadrilatere elargi de pad fois sa hauteur de chaque cote'''
+    pts = np.asarray(poly, dtype=np.float32)
+    across, down = pts[1] - pts[0], pts[3] - pts[0]
+    margin = pad * min(np.linalg.norm(across), np.linalg.norm(down))
+    u = across / max(np.linalg.norm(across), 1e-6) * margin
+    v = down / max(np.linalg.norm(down), 1e-6) * margin
+    return pts + np.float32([-u - v, u - v, u + v, -u + v])
+
+
+def enhance_crop(crop, scale=CASCADE_UPSCALE, profile=CASCADE_PROFILE):
+    '''Deuxieme passe de la cascade : ligne agrandie puis fortement pretraitee'''
+    big = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    return prepare_page(big, big.shape[0], profile)
+
+
+def poly_to_box(poly, y_offset=0):
+    '''Boite englobante [x1, y1, x2, y2] en coordonnees page'''
+    xs, ys = poly[:, 0], poly[:, 1]
+    return [int(xs.min()), int(ys.min()) + y_offset, int(xs.max()), int(ys.max()) + y_offset]
+
+
+def in_handled_overlap(box, y_start, prev_end):
+    '''La boite est entierement dans le recouvrement deja lu par le morceau precedent'''
+    return prev_end is not None and box[1] >= y_start and box[3] <= prev_end - EDGE_MARGIN
+
+
+def box_iou(a, b):
+    '''IoU et recouvrement relatif a la plus petite des deux boites'''
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0, 0.0
+
+    inter = iw * ih
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / (area_a + area_b - inter), inter / max(min(area_a, area_b), 1)
+
+
+def merge_records(records, iou=DEDUP_IOU, contain=DEDUP_CONTAIN):
+    '''Supprime les doublons vus dans deux morceaux et trie en ordre de lecture
+
+    En cas de doublon on garde la plus grande boite (l'autre a souvent ete
+    coupee par le bord du morceau), puis la plus confiante.
+    '''
+    def area(rec):
+        x1, y1, x2, y2 = rec['box']
+        return (x2 - x1) * (y2 - y1)
+
+    kept = []
+    for rec in sorted(records, key=lambda r: (area(r), r['score']), reverse=True):
+        duplicate = False
+        for other in kept:
+            overlap, contained = box_iou(rec['box'], other['box'])
+            if overlap > iou or contained > contain:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(rec)
+
+    return sorted(kept, key=lambda r: (r['box'][1], r['box'][0]))
+
+
+def _merge_rects(rects):
+    '''Fusionne les rectangles qui se chevauchent (jusqu'a stabilite)'''
+    rects = [list(r) for r in rects]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(r) for r in rects]
+
+
+def find_bubble_rois(chunk):
+    '''Zones susceptibles de contenir du texte : [(x1, y1, x2, y2)] dans le morceau
+
+    Seuillage des zones claires, ouverture pour couper les liaisons fines
+    avec le fond, puis contours des composantes : on garde les regions assez grandes, assez
+    compactes, qui ne sont pas le fond de la page et qui contiennent un peu
+    d'encre (le texte). Les zones sont elargies de ROI_PAD et fusionnees.
+    '''
+    gray = chunk if chunk.ndim == 2 else cv2.cvtColor(chunk, cv2.COLOR_BGR2GRAY)
+    h, w = gray.shape
+    _, bright = cv2.threshold(gray, ROI_BRIGHT, 255, cv2.THRESH_BINARY)
+    bright = cv2.morphologyEx(bright, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
+
+    # RETR_CCOMP : une bulle blanche cernee de noir sur fond blanc est une
+    # composante a part (contour exterieur, sans parent) et non un trou du fond
+    contours, hierarchy = cv2.findContours(bright, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    rects = []
+    for contour, (_, _, _, parent) in zip(contours, hierarchy[0] if hierarchy is not None else ()):
+        if parent >= 0:
+            continue
+        x, y, cw, ch = cv2.boundingRect(contour)
+        area = cv2.contourArea(contour)
+        if area < ROI_MIN_AREA or cw * ch > ROI_MAX_FRACTION * w * h:
+            continue
+        if area < ROI_MIN_FILL * cw * ch:
+            continue
+        # Encre = pixels sombres a l'interieur du contour (trous de la region claire)
+        inside = np.zeros((ch, cw), dtype=np.uint8)
+        cv2.drawContours(inside, [contour], -1, 255, cv2.FILLED, offset=(-x, -y))
+        ink = cv2.countNonZero(cv2.bitwise_and(inside, cv2.bitwise_not(bright[y:y + ch, x:x + cw])))
+        if not ROI_INK[0] <= ink / area <= ROI_INK[1]:
+            continue
+        rects.append((max(0, x - ROI_PAD), max(0, y - ROI_PAD),
+                      min(w, x + cw + ROI_PAD), min(h, y + ch + ROI_PAD)))
+
+    return sorted(_merge_rects(rects), key=lambda r: (r[1], r[0]))
+
+
+def _round_up(value, step=DET_STRIDE):
+    return -(-value // step) * step
+
+
+def pack_rois(sizes, max_side=DET_MAX_SIDE, gap=ROI_GAP):
+    '''Rangement de zones (h, w) sur des planches : [((H, W), [(indice, x, y)])]
+
+    Etageres remplies de gauche a droite, zones les plus hautes d'abord ;
+    largeur des planches = la plus large zone. Les cotes sont arrondis a
+    DET_STRIDE et une planche ne depasse pas max_side de haut (sauf zone
+    plus haute a elle seule), pour que le detecteur ne la redimensionne pas.
+    '''
+    width = _round_up(max(w for h, w in sizes))
+    sheets = []
+    places = []
+    x = y = shelf = 0
+    for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][0]):
+        h, w = sizes[i]
+        if x and x + w > width:
+            x, y, shelf = 0, y + shelf + gap, 0
+        if places and y + h > max_side:
+            sheets.append(((_round_up(y - gap if not x else y + shelf), width), places))
+            places, x, y, shelf = [], 0, 0, 0
+        places.append((i, x, y))
+        x += w + gap
+        shelf = max(shelf, h)
+    sheets.append(((_round_up(y + shelf), width), places))
+    return sheets
+
+
+def _detect_chunk(engine, chunk, roi, stats):
+    '''Polygones d'un morceau, par zones candidates si roi (repli : morceau entier)
+
+    Les zones sont rangees sur des planches (pack_rois) : un appel au
+    detecteur par morceau au lieu d'un par zone. Chaque polygone revient a la
+    zone qui contient son centre, rogne a ses bords comme le ferait le
+    detecteur sur la zone seule.
+    '''
+    h, w = chunk.shape[:2]
+    rects = find_bubble_rois(chunk) if roi else []
+    if stats is not None:
+        stats['chunk_area'] += h * w
+        stats['det_area'] += sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in rects) if rects else h * w
+    if not rects:
+        return engine.detect(chunk)
+
+    sizes = [(y2 - y1, x2 - x1) for x1, y1, x2, y2 in rects]
+    sheets = pack_rois(sizes)
+    images = []
+    for shape, places in sheets:
+        sheet = np.full(shape + chunk.shape[2:], 255, dtype=chunk.dtype)
+        for i, x, y in places:
+            x1, y1, x2, y2 = rects[i]
+            sheet[y:y + y2 - y1, x:x + x2 - x1] = chunk[y1:y2, x1:x2]
+        images.append(sheet)
+
+    polys = []
+    for (shape, places), found in zip(sheets, engine.detect_many(images)):
+        for poly in found:
+            cx, cy = poly.mean(axis=0)
+            for i, x, y in places:
+                rh, rw = sizes[i]
+                if x <= cx < x + rw and y <= cy < y + rh:
+                    x1, y1 = rects[i][:2]
+                    local = np.clip(poly - np.float32([x, y]), 0, np.float32([rw, rh]))
+                    polys.append(local + np.float32([x1, y1]))
+                    break
+    return polys
+
+
+def detect_crops(engine, chunks, trace=None, roi=False, stats=None, on_chunk=None, wide=None):
+    '''Detection par morceau ; retourne [(index morceau, crop, box page)]
+
+    Les boites deja lues par le morceau precedent (recouvrement) sont ignorees.
+    trace : liste recevant un evenement par morceau. roi : detection sur les
+    seules zones de find_bubble_rois ; stats['det_area'] / stats['chunk_area']
+    cumulent alors la surface envoyee au detecteur et la surface totale.
+    on_chunk(y_end) est appele apres chaque morceau. wide : liste recevant,
+    dans le meme ordre, chaque ligne recadree avec une marge (pad_poly) pour
+    la deuxieme passe de la cascade ; le morceau n'est plus la ensuite.
+    '''
+    jobs = []
+    prev_end = None
+
+    for idx, (chunk, y_start, y_end) in enumerate(chunks):
+        start = time.perf_counter()
+        count = len(jobs)
+        for poly in _detect_chunk(engine, chunk, roi, stats):
+            box = poly_to_box(poly, y_start)
+            if not in_handled_overlap(box, y_start, prev_end):
+                jobs.append((idx, crop_box(chunk, poly), box))
+                if wide is not None:
+                    wide.append(crop_box(chunk, pad_poly(poly)))
+        prev_end = y_end
+        _add_time(None, 'detect', start, trace, chunk=idx, y=y_start, boxes=len(jobs) - count)
+        if on_chunk is not None:
+            on_chunk(y_end)
+
+    return jobs
+
+
+def in_script(text, lang):
+    '''Vrai si la majorite des lettres de text sont dans l'ecriture de lang'''
+    letters = [c for c in text if c.isalpha()]
+    if not letters:
+        return False
+    matches = sum(1 for c in letters if LANG_SCRIPTS[lang].match(c))
+    return matches * 2 > len(letters)
+
+
+def needs_second_opinion(text, score, lang):
+    '''Une ligne lue par lang doit-elle etre relue par les autres langues ?'''
+    return score < SECOND_OPINION_SCORE or not in_script(text, lang)
+
+
+def recognize_routed(engines, crops, batch_size=REC_BATCH_SIZE, bucket=False):
+    '''Reconnaissance multilingue de boites detectees une seule fois
+
+    La premiere langue lit toutes les lignes ; chaque langue suivante ne
+    relit que celles qui ne sont pas clairement dans l'ecriture de la
+    meilleure lecture actuelle, et la lecture la plus confiante est gardee.
+    Retourne [(texte, score, langue)] dans l'ordre des crops.
+    '''
+    langs = list(engines)
+    results = [(text, score, langs[0])
+               for text, score in engines[langs[0]].recognize(crops, batch_size, bucket)]
+
+    for lang in langs[1:]:
+        retry = [i for i, (text, score, best) in enumerate(results)
+                 if needs_second_opinion(text, score, best)]
+        texts = engines[lang].recognize([crops[i] for i in retry], batch_size, bucket)
+        for i, (text, score) in zip(retry, texts):
+            if score > results[i][1]:
+                results[i] = (text, score, lang)
+
+    return results
+
+
+def _gap(a1, a2, b1, b2):
+    '''Ecart entre deux intervalles (0 s'ils se chevauchent)'''
+    return max(0, max(a1, b1) - min(a2, b2))
+
+
+def _same_bubble(a, b, gap_x, gap_y):
+    '''Deux lignes de la meme bulle : empilees (chevauchement horizontal et
+    petit ecart vertical) ou cote a cote sur la meme ligne'''
+    h = min(a[3] - a[1], b[3] - b[1])
+    dx = _gap(a[0], a[2], b[0], b[2])
+    dy = _gap(a[1], a[3], b[1], b[3])
+    if dx == 0:
+        return dy <= gap_y * h
+    if dy == 0:
+        return dx <= gap_x * h
+    return False
+
+
+def reading_order(boxes):
+    '''Indices des boites de haut en bas, de gauche a droite sur une meme rangee
+
+    Une boite rejoint la rangee en cours si elle commence avant le milieu
+    de la premiere boite de la rangee.
+    '''
+    order = sorted(range(len(boxes)), key=lambda i: (boxes[i][1], boxes[i][0]))
+    rows = []
+    for i in order:
+        if rows:
+            first = boxes[rows[-1][0]]
+            if boxes[i][1] < (first[1] + first[3]) / 2:
+                rows[-1].append(i)
+                continue
+        rows.append([i])
+    return [i for row in rows for i in sorted(row, key=lambda i: boxes[i][0])]
+
+
+def cluster_boxes(boxes, gap_x=BUBBLE_GAP_X, gap_y=BUBBLE_GAP_Y, cell=BUBBLE_GRID_CELL):
+    '''Regroupe des boites [x1, y1, x2, y2] en bulles ; retourne des listes d'indices
+
+    Grille uniforme : chaque boite est rangee dans les cases qu'elle couvre
+    et ne compare que les boites des cases couvertes par sa zone de
+    voisinage (boite elargie de gap_x / gap_y hauteurs de ligne). Les liens
+    sont fusionnes par union-find, donc le cout reste quasi lineaire sur les
+    pages tres chargees. Bulles et lignes sont rendues en ordre de lecture.
+    '''
+    parent = list(range(len(boxes)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def cells(x1, y1, x2, y2):
+        return itertools.product(range(int(x1 // cell), int(x2 // cell) + 1),
+                                 range(int(y1 // cell), int(y2 // cell) + 1))
+
+    grid = {}
+    for i, box in enumerate(boxes):
+        x1, y1, x2, y2 = box
+        h = y2 - y1
+        candidates = set()
+        for key in cells(x1 - gap_x * h, y1 - gap_y * h, x2 + gap_x * h, y2 + gap_y * h):
+            candidates.update(grid.get(key, ()))
+        for j in candidates:
+            if _same_bubble(box, boxes[j], gap_x, gap_y):
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j:
+                    parent[root_i] = root_j
+        for key in cells(x1, y1, x2, y2):
+            grid.setdefault(key, []).append(i)
+
+    clusters = {}
+    for i in range(len(boxes)):
+        clusters.setdefault(find(i), []).append(i)
+
+    groups = []
+    for members in clusters.values():
+        lines = reading_order([boxes[i] for i in members])
+        groups.append([members[k] for k in lines])
+
+    bounds = [[min(boxes[i][0] for i in g), min(boxes[i][1] for i in g),
+               max(boxes[i][2] for i in g), max(boxes[i][3] for i in g)] for g in groups]
+    return [groups[k] for k in reading_order(bounds)]
+
+
+def group_records(records, gap_x=BUBBLE_GAP_X, gap_y=BUBBLE_GAP_Y):
+    '''Regroupe en bulles les result['records'] d'une page : [(texte, score moyen)]'''
+    result = []
+    for members in cluster_boxes([rec['box'] for rec in records], gap_x, gap_y):
+        combined_text = smart_postprocess(' '.join(records[i]['text'] for i in members))
+        avg_score = sum(records[i]['score'] for i in members) / len(members)
+        result.append((combined_text, avg_score))
+    return result
+
+
+def recognition_units(langs, options):
+    '''Passes d'OCR d'une extraction : 'korean+en' en mode bilingue partage,
+    sinon une passe par langue'''
+    langs = list(langs)
+    if len(langs) > 1 and options['bilingual'] == 'shared':
+        return ['+'.join(langs)]
+    return langs
+
+
+def ocr_settings(unit, options):
+    '''Tous les reglages qui changent le resultat brut de l'OCR (cle de cache)'''
+    langs = unit.split('+')
+    settings = {
+        'version': 2,
+        'lang': unit,
+        'preprocess': [page_profile(options), CLAHE_GRID, PREPROCESS_PROFILES[page_profile(options)]],
+        'chunk_height': options['chunk_height'] or ['auto', DET_MAX_SIDE, DET_STRIDE, MIN_CHUNK_HEIGHT],
+        'tiled': [options['tiled'], TILED_MIN_HEIGHT],
+        'overlap': OVERLAP,
+        'split_mode': options['split_mode'],
+        'gutters': [BLANK_TOLERANCE, GUTTER_BLUR, GUTTER_NOISE, MIN_GUTTER, GUTTER_MARGIN],
+        'edge_margin': EDGE_MARGIN,
+        'roi': [ROI_BRIGHT, ROI_MIN_AREA, ROI_MAX_FRACTION, ROI_MIN_FILL, ROI_INK, ROI_PAD, ROI_GAP] if options['roi'] else None,
+        'ocr': OCR_PARAMS,
+        'models': [DET_MODEL] + [REC_MODELS[lang] for lang in langs] + [ORI_MODEL],
+    }
+    if len(langs) > 1:
+        settings['second_opinion'] = SECOND_OPINION_SCORE
+    if options['text_filter'] is not None:
+        settings['text_filter'] = [options['text_filter'], TEXT_SCALE, TEXT_EDGE_CONTRAST, TEXT_CELL,
+                                   TEXT_DENSITY, TEXT_MIN_FILL]
+    if options['cascade']:
+        settings['cascade'] = [CASCADE_PROFILE, PREPROCESS_PROFILES[CASCADE_PROFILE], CASCADE_BAND,
+                               CASCADE_UPSCALE, CASCADE_PAD]
+    if options['phash']:
+        # Le resultat contient alors le texte repris (ou saute) des bandes connues
+        settings['phash'] = [DHASH_SIZE, DHASH_MAX_DISTANCE, THUMB_MAX_DIFF, ASPECT_TOLERANCE, BAND_MIN_HEIGHT]
+    return settings
+
+
+def job_settings(langs, options):
+    '''Reglages d'une extraction de chapitre (points de controle)'''
+    return {'min_score': MIN_SCORE,
+            'ocr': {unit: ocr_settings(unit, options) for unit in recognition_units(langs, options)}}
+
+
+def page_cache_key(result, unit):
+    return OcrCache.key(result['digest'], ocr_settings(unit, result['options']))
+
+
+def new_page_result(img_path, error=None, options=None):
+    '''Resultat vide d'une page (format commun au pipeline et au pool)'''
+    return {'path': str(img_path), 'width': 0, 'height': 0,
+            'chunks': 0, 'skipped_rows': 0, 'records': [], 'error': error,
+            'rec_lines': 0, 'rec_seconds': 0.0,
+            'digest': None, 'options': options or make_options(), 'cached': [],
+            'timings': {}, 'denoised_bands': 0, 'bands': 0, 'det_area': 0, 'chunk_area': 0,
+            'chunk_height': 0, 'det_scale': 1.0, 'bands_reused': 0, 'bands_skipped': 0,
+            'retried': 0, 'recovered': 0, 'filtered': 0,
+            'trace': [] if (options or DEFAULT_OPTIONS)['trace'] else None}
+
+
+def add_lines(result, lines, min_score=MIN_SCORE):
+    '''Filtre et fusionne les lignes brutes (texte, score, box, langue) d'une passe'''
+    records = [{'text': text.strip(), 'score': score, 'box': box, 'lang': lang}
+               for text, score, box, lang in lines if is_kept(text, score, min_score)]
+    result['records'].extend(merge_records(records))
+
+
+def prepare_chunks(img_path, options=None, data=None, cache=None, units=()):
+    '''Decodage, pretraitement et decoupe d'une page (sans OCR)
+
+    options : voir make_options. data : octets deja lus (pipeline) ; sinon
+    le fichier est lu ici.
+    cache : si toutes les passes (units, voir recognition_units) sont deja
+    en cache, la page n'est meme pas decodee et ses enregistrements sont
+    remplis directement.
+    Retourne (result, chunks) ; chunks vaut None s'il n'y a rien a lire.
+    '''
+    result = new_page_result(img_path, options=options)
+    options = result['options']
+    timings = result['timings']
+    trace = result['trace']
+
+    if data is None:
+        start = time.perf_counter()
+        data = read_bytes(img_path)
+        _add_time(timings, 'read', start, trace, bytes=0 if data is None else len(data))
+    if data is not None:
+        result['digest'] = digest_bytes(data)
+
+    if cache is not None and data is not None:
+        start = time.perf_counter()
+        for unit in units:
+            entry = cache.get(page_cache_key(result, unit))
+            if entry is None:
+                continue
+            for field in ('width', 'height', 'chunks', 'skipped_rows'):
+                result[field] = entry[field]
+            add_lines(result, entry['lines'])
+            result['cached'].append(unit)
+        _add_time(None, 'cache', start, trace, hits=len(result['cached']))
+        if units and len(result['cached']) == len(units):
+            return result, None
+
+    size = png_info(data) if data is not None and options['tiled'] is not False else None
+    if size is not None and (options['tiled'] or size[1] >= TILED_MIN_HEIGHT):
+        w, h = size
+        result['width'], result['height'] = w, h
+        chunk_height, overlap = chunk_geometry(w, options)
+        result['chunk_height'] = chunk_height
+        return result, TiledChunks(data, result, chunk_height, overlap)
+
+    start = time.perf_counter()
+    img = decode_image(data)
+    _add_time(timings, 'decode', start, trace)
+    if img is None:
+        result['error'] = 'Impossible de lire l\'image'
+        return result, None
+
+    h, w = img.shape[:2]
+    result['width'], result['height'] = w, h
+
+    chunk_height, overlap = chunk_geometry(w, options)
+    result['chunk_height'] = chunk_height
+
+    stats = {'bands': 0, 'denoised_bands': 0}
+    if options['text_filter'] is not None:
+        chunks = filter_chunks(img, chunk_height, overlap, options, result, stats)
+        del img
+        start = time.perf_counter()
+    else:
+        page = prepare_page(img, chunk_height, page_profile(options), timings, stats, trace)
+        del img
+        start = time.perf_counter()
+        chunks = split_long_image(page, chunk_height, overlap, options['split_mode'])
+    result['bands'], result['denoised_bands'] = stats['bands'], stats['denoised_bands']
+    result['chunks'] = len(chunks)
+    result['skipped_rows'] = count_skipped_rows(chunks, h)
+    # Plus forte reduction appliquee par le detecteur (1.0 : aucune)
+    result['det_scale'] = min((det_input_scale(y_end - y, w) for _, y, y_end in chunks), default=1.0)
+    _add_time(timings, 'split', start, trace, chunks=len(chunks))
+
+    return result, chunks
+
+
+def _known_bands(chunks, index, settings, result, known, bands):
+    '''Morceaux a lire ; ceux deja dans l'index perceptuel sont servis directement
+
+    known recoit les lignes reprises (coordonnees page), bands la signature
+    de chaque morceau rendu, dans l'ordre, pour l'enregistrer apres l'OCR.
+    '''
+    for chunk, y_start, y_end in chunks:
+        signature = band_signature(chunk)
+        entry = None if signature is None else index.lookup(signature, settings)
+        if entry is None:
+            bands.append((signature, y_start, chunk.shape[1]))
+            yield chunk, y_start, y_end
+            continue
+
+        if entry['action'] == 'skip':
+            result['bands_skipped'] += 1
+        else:
+            result['bands_reused'] += 1
+            width = chunk.shape[1]
+            for text, score, box, lang in entry['lines']:
+                x1, y1, x2, y2 = (round(v * width) for v in box)
+                known.append((text, score, [x1, y1 + y_start, x2, y2 + y_start], lang))
+
+
+def recognize_pages(pages, engines, batched=True, min_score=MIN_SCORE, cache=None, on_chunk=None):
+    '''OCR de plusieurs pages deja decoupees : pages = [(result, chunks)]
+
+    batched=True  : detection par morceau, puis les lignes de toutes les
+                    pages sont lues ensemble en gros lots tries par format.
+    batched=False : une reconnaissance par morceau (ancien comportement).
+
+    Avec plusieurs langues en mode bilingue 'shared', la detection n'est
+    faite qu'une fois et chaque boite est aiguillee (voir recognize_routed).
+
+    Les enregistrements sont redistribues dans result['records'] de chaque
+    page ; rec_lines / rec_seconds permettent de mesurer le debit. Les
+    passes deja servies par le cache sont sautees, les autres y sont ecrites.
+    on_chunk(result, y_end) suit la detection morceau par morceau ; il peut
+    lever ExtractionCancelled, qui est propagee telle quelle.
+    Option 'phash' (avec un cache) : les bandes deja connues ne sont pas
+    relues, les autres sont ajoutees a l'index apres l'OCR.
+    Option 'cascade' : les lignes lues avec un score dans CASCADE_BAND sont
+    relues une fois agrandies et pretraitees (enhance_crop) ; la meilleure
+    lecture est gardee. result['retried'] compte ces lignes, et
+    result['recovered'] celles qui passent ainsi le seuil min_score.
+    '''
+    options = pages[0][0]['options'] if pages else DEFAULT_OPTIONS
+    units = recognition_units(engines, options)
+    index = cache.bands if cache is not None and options['phash'] else None
+    cascade = options['cascade']
+
+    for unit in units:
+        unit_engines = {lang: engines[lang] for lang in unit.split('+')}
+        detector = next(iter(unit_engines.values()))
+        todo = [(result, chunks) for result, chunks in pages
+                if chunks is not None and not result['error'] and unit not in result['cached']]
+        # Index des bandes : texte brut de l'OCR, commun aux extractions avec ou sans phash
+        band_settings = None
+        if index is not None:
+            band_settings = OcrCache.key('bands', ocr_settings(unit, dict(options, phash=False)))
+        known = [[] for _ in todo]
+        bands = [[] for _ in todo]
+
+        jobs = []
+        wide = []
+        for page_idx, (result, chunks) in enumerate(todo):
+            start = time.perf_counter()
+            if index is not None:
+                chunks = _known_bands(chunks, index, band_settings, result, known[page_idx], bands[page_idx])
+            progress = None if on_chunk is None else functools.partial(on_chunk, result)
+            page_wide = [] if cascade else None
+            try:
+                for chunk_idx, crop, box in detect_crops(detector, chunks, result['trace'],
+                                                         result['options']['roi'], result, progress,
+                                                         page_wide):
+                    jobs.append((page_idx, chunk_idx, crop, box))
+                if cascade:
+                    wide.extend(page_wide)
+            except ExtractionCancelled:
+                raise
+            except Exception as e:
+                result['error'] = str(e)
+            _add_time(result['timings'], 'detect', start)
+
+        start = time.perf_counter()
+        try:
+            if batched:
+                texts = recognize_routed(unit_engines, [job[2] for job in jobs],
+                                         batch_size=REC_BATCH_LARGE, bucket=True)
+            else:
+                texts = []
+                for _, group in itertools.groupby(jobs, key=lambda job: job[:2]):
+                    texts.extend(recognize_routed(unit_engines, [job[2] for job in group]))
+            elapsed = time.perf_counter() - start
+
+            # Cascade : seules les lignes peu sures paient le pretraitement fort
+            start = time.perf_counter()
+            retried = [0] * len(todo)
+            if cascade:
+                retry = [i for i, (text, score, lang) in enumerate(texts)
+                         if CASCADE_BAND[0] <= score < CASCADE_BAND[1]]
+                second = recognize_routed(unit_engines, [enhance_crop(wide[i]) for i in retry],
+                                          batch_size=REC_BATCH_LARGE, bucket=True)
+                for i, (text, score, lang) in zip(retry, second):
+                    page_idx = jobs[i][0]
+                    retried[page_idx] += 1
+                    if score > texts[i][1]:
+                        if is_kept(text, score, min_score) and not is_kept(*texts[i][:2], min_score):
+                            todo[page_idx][0]['recovered'] += 1
+                        texts[i] = (text, score, lang)
+            retry_elapsed = time.perf_counter() - start
+        except Exception as e:
+            for result, chunks in todo:
+                result['error'] = str(e)
+            continue
+
+        per_page = [[] for _ in todo]
+        per_band = {}
+        for (page_idx, chunk_idx, crop, box), (text, score, lang) in zip(jobs, texts):
+            per_page[page_idx].append((text, score, box, lang))
+            per_band.setdefault((page_idx, chunk_idx), []).append((text, score, box, lang))
+
+        if index is not None:
+            for page_idx, ((result, chunks), page_bands) in enumerate(zip(todo, bands)):
+                if result['error']:
+                    continue
+                for chunk_idx, (signature, y_start, width) in enumerate(page_bands):
+                    if signature is None:
+                        continue
+                    lines = [(text, score, [box[0], box[1] - y_start, box[2], box[3] - y_start], lang)
+                             for text, score, box, lang in per_band.get((page_idx, chunk_idx), ())]
+                    index.add(signature, band_settings, lines, width, result['path'])
+
+        for (result, chunks), lines, reused, page_retried in zip(todo, per_page, known, retried):
+            share = elapsed * len(lines) / max(len(jobs), 1)
+            result['rec_lines'] += len(lines)
+            result['rec_seconds'] += share
+            result['timings']['recognize'] = result['rec_seconds']
+            if result['trace'] is not None:
+                result['trace'].append(trace_event('recognize', share, boxes=len(lines), batch=len(jobs)))
+            if page_retried:
+                share = retry_elapsed * page_retried / sum(retried)
+                result['retried'] += page_retried
+                result['timings']['retry'] = result['timings'].get('retry', 0.0) + share
+                if result['trace'] is not None:
+                    result['trace'].append(trace_event('retry', share, boxes=page_retried))
+
+            # Bandes connues : texte repris de l'index, sans OCR
+            lines = lines + reused
+
+            start = time.perf_counter()
+            add_lines(result, lines, min_score)
+            _add_time(result['timings'], 'postprocess', start, result['trace'],
+                      boxes=len(result['records']))
+
+            if cache is not None and result['digest'] and not result['error']:
+                cache.put(page_cache_key(result, unit), {
+                    'width': result['width'],
+                    'height': result['height'],
+                    'chunks': result['chunks'],
+                    'skipped_rows': result['skipped_rows'],
+                    'lines': lines,
+                })
+
+    # Ordre des passes stable, que les resultats viennent du cache ou non ;
+    # une passe bilingue reste en ordre de lecture
+    order = {lang: i for i, unit in enumerate(units) for lang in unit.split('+')}
+    for result, chunks in pages:
+        result['records'].sort(key=lambda rec: order.get(rec['lang'], len(units)))
+
+    return [result for result, chunks in pages]
+
+
+def recognize_page(result, chunks, engines, batched=True, cache=None):
+    '''OCR des morceaux d'une page, pour chaque langue, dans result['records']'''
+    return recognize_pages([(result, chunks)], engines, batched, cache=cache)[0]
+
+
+def extract_page(img_path, engines, options=None, batched=True, cache=None):
+    '''Traitement complet d'une page : decodage, pretraitement, decoupe, OCR
+
+    engines : {lang: OcrEngine}. Retourne un dict serialisable (il traverse
+    les processus du pool) ; 'error' est rempli si la page n'a pas pu etre lue.
+    '''
+    options = make_options(**(options or {}))
+    result, chunks = prepare_chunks(img_path, options, cache=cache,
+                                    units=recognition_units(engines, options))
+    if chunks is None:
+        return result
+    return recognize_page(result, chunks, engines, batched, cache)
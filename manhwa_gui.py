@@ -6,14 +6,19 @@ Manhwa Text Extractor - Interface Graphique
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
+import multiprocessing
+import queue
+import time
 from pathlib import Path
-import cv2
-import numpy as np
-from paddleocr import PaddleOCR
-from docx import Document
-from docx.shared import Pt, RGBColor
-import os
-import re
+
+from manhwa_core import create_ocr, group_records, job_settings, make_options, ExtractionCancelled
+from manhwa_checkpoint import ChapterJob
+from manhwa_cache import OcrCache
+from manhwa_pool import iter_pages
+from manhwa_server import connect_server
+from manhwa_trace import Tracer
+from manhwa_output import DocxWriter
+from manhwa_sources import open_source, ARCHIVE_SUFFIXES, PDF_SUFFIXES
 
 
 class ManhwaExtractorGUI:
@@ -26,14 +31,25 @@ class ManhwaExtractorGUI:
         self.folder_path = tk.StringVar()
         self.status_text = tk.StringVar(value="Prêt")
         self.progress_value = tk.DoubleVar(value=0)
+        self.eta_text = tk.StringVar(value="")
         self.korean_enabled = tk.BooleanVar(value=True)
         self.english_enabled = tk.BooleanVar(value=False)
+        self.workers = tk.IntVar(value=1)
+        self.known_bands = tk.BooleanVar(value=False)
         self.is_processing = False
         
         self.ocr_ko = None
         self.ocr_en = None
+        self.cache = None
+        self.tracer = None
+        
+        # Le thread d'extraction ne touche jamais a Tk : il poste des
+        # evenements que la boucle principale depile (poll_events)
+        self.events = queue.Queue()
+        self.cancel_requested = threading.Event()
         
         self.setup_ui()
+        self.root.after(100, self.poll_events)
     
     def setup_ui(self):
         style = ttk.Style()
@@ -90,6 +106,21 @@ class ManhwaExtractorGUI:
         )
         browse_btn.pack(side=tk.RIGHT, padx=10, pady=10)
         
+        # Archive CBZ/ZIP ou PDF, lue sans extraction sur le disque
+        file_btn = tk.Button(
+            folder_frame,
+            text="CBZ / PDF...",
+            command=self.browse_file,
+            bg="#3498DB",
+            fg="white",
+            font=("Segoe UI", 10, "bold"),
+            cursor="hand2",
+            relief=tk.FLAT,
+            padx=10,
+            pady=5
+        )
+        file_btn.pack(side=tk.RIGHT, pady=10)
+        
         # Zone drop
         drop_frame = tk.Frame(main_frame, bg="white", relief=tk.RIDGE, borderwidth=2)
         drop_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 15))
@@ -136,6 +167,34 @@ class ManhwaExtractorGUI:
         )
         english_check.pack(side=tk.LEFT, padx=20)
         
+        # Credits, bannieres... deja lus dans un autre chapitre (manhwa_phash)
+        known_check = tk.Checkbutton(
+            options_inner,
+            text="♻ Bandes connues",
+            variable=self.known_bands,
+            font=("Segoe UI", 10),
+            bg="#ECF0F1"
+        )
+        known_check.pack(side=tk.LEFT, padx=10)
+        
+        workers_label = tk.Label(
+            options_inner,
+            text="⚡ Processus :",
+            font=("Segoe UI", 10),
+            bg="#ECF0F1"
+        )
+        workers_label.pack(side=tk.LEFT, padx=(20, 5))
+        
+        workers_spin = tk.Spinbox(
+            options_inner,
+            from_=1,
+            to=32,
+            width=3,
+            textvariable=self.workers,
+            font=("Segoe UI", 10)
+        )
+        workers_spin.pack(side=tk.LEFT)
+        
         # Bouton extraction
         extract_btn = tk.Button(
             main_frame,
@@ -149,6 +208,7 @@ class ManhwaExtractorGUI:
             pady=15
         )
         extract_btn.pack(fill=tk.X, pady=(0, 15))
+        self.extract_btn = extract_btn
         
         # Progression
         progress_frame = tk.LabelFrame(
@@ -168,6 +228,40 @@ class ManhwaExtractorGUI:
         )
         self.progress_bar.pack(fill=tk.X, padx=10, pady=10)
         
+        progress_actions = tk.Frame(progress_frame, bg="#ECF0F1")
+        progress_actions.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        eta_label = tk.Label(
+            progress_actions,
+            textvariable=self.eta_text,
+            font=("Segoe UI", 9),
+            bg="#ECF0F1",
+            fg="#7F8C8D",
+            anchor="w"
+        )
+        eta_label.pack(side=tk.LEFT)
+        
+        timings_btn = tk.Button(
+            progress_actions,
+            text="⏱ Afficher les temps",
+            command=self.show_timings,
+            font=("Segoe UI", 9),
+            cursor="hand2",
+            relief=tk.FLAT
+        )
+        timings_btn.pack(side=tk.RIGHT)
+        
+        self.cancel_btn = tk.Button(
+            progress_actions,
+            text="■ Annuler",
+            command=self.cancel_extraction,
+            font=("Segoe UI", 9),
+            cursor="hand2",
+            relief=tk.FLAT,
+            state=tk.DISABLED
+        )
+        self.cancel_btn.pack(side=tk.RIGHT, padx=(0, 10))
+        
         # Status
         status_label = tk.Label(
             main_frame,
@@ -189,15 +283,99 @@ class ManhwaExtractorGUI:
         )
         footer.pack(side=tk.BOTTOM, pady=5)
     
+    def show_timings(self):
+        if self.tracer is None or not self.tracer.events:
+            messagebox.showinfo("Temps", "Lancez d'abord une extraction.")
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("⏱ Temps par étape")
+        window.geometry("720x320")
+        
+        columns = ("nb", "total", "moy", "p50", "p95", "max", "boites", "octets")
+        tree = ttk.Treeview(window, columns=columns, height=10)
+        tree.heading("#0", text="Étape")
+        tree.column("#0", width=110)
+        for col in columns:
+            tree.heading(col, text=col)
+            tree.column(col, width=70, anchor="e")
+        
+        for name, count, total, mean, p50, p95, peak, boxes, read in self.tracer.summary():
+            tree.insert("", tk.END, text=name, values=(
+                count, f"{total:.2f} s", f"{mean:.1f} ms", f"{p50:.1f} ms",
+                f"{p95:.1f} ms", f"{peak:.1f} ms", boxes or "", read or ""
+            ))
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        def save_trace():
+            path = filedialog.asksaveasfilename(
+                parent=window,
+                defaultextension=".json",
+                filetypes=[("Chrome trace", "*.json"), ("JSONL", "*.jsonl")]
+            )
+            if path:
+                self.tracer.write(path)
+        
+        save_btn = tk.Button(window, text="💾 Enregistrer la trace…", command=save_trace)
+        save_btn.pack(pady=(0, 10))
+    
+    def post(self, kind, *args):
+        '''Evenement pour la boucle Tk (appelable depuis n'importe quel thread)'''
+        self.events.put((kind, args))
+    
+    def poll_events(self):
+        '''Applique les evenements du thread d'extraction (thread Tk uniquement)'''
+        try:
+            while True:
+                kind, args = self.events.get_nowait()
+                if kind == 'status':
+                    self.status_text.set(args[0])
+                elif kind == 'progress':
+                    self.progress_value.set(args[0])
+                elif kind == 'eta':
+                    self.eta_text.set(args[0])
+                elif kind == 'info':
+                    messagebox.showinfo(*args)
+                elif kind == 'error':
+                    messagebox.showerror(*args)
+                elif kind == 'finished':
+                    self.is_processing = False
+                    self.extract_btn.config(state=tk.NORMAL)
+                    self.cancel_btn.config(state=tk.DISABLED)
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_events)
+    
+    def cancel_extraction(self):
+        if self.is_processing and not self.cancel_requested.is_set():
+            self.cancel_requested.set()
+            self.cancel_btn.config(state=tk.DISABLED)
+            self.status_text.set("⏹ Annulation au prochain morceau...")
+    
     def browse_folder(self):
         folder = filedialog.askdirectory(
             title="Sélectionnez le dossier du manhwa"
         )
         if folder:
-            self.folder_path.set(folder)
-            path = Path(folder)
-            images = list(path.glob('*.jpeg')) + list(path.glob('*.jpg')) + list(path.glob('*.png'))
-            self.status_text.set(f"✓ {len(images)} images trouvées")
+            self.set_source(folder)
+    
+    def browse_file(self):
+        patterns = ' '.join(f'*{suffix}' for suffix in ARCHIVE_SUFFIXES + PDF_SUFFIXES)
+        path = filedialog.askopenfilename(
+            title="Sélectionnez l'archive ou le PDF du chapitre",
+            filetypes=[("Chapitre", patterns), ("Tous les fichiers", "*.*")]
+        )
+        if path:
+            self.set_source(path)
+    
+    def set_source(self, path):
+        self.folder_path.set(path)
+        try:
+            images = open_source(path).pages()
+        except Exception as e:
+            self.status_text.set(f"❌ Illisible : {e}")
+            return
+        self.status_text.set(f"✓ {len(images)} images trouvées")
     
     def start_extraction(self):
         if self.is_processing:
@@ -213,174 +391,165 @@ class ManhwaExtractorGUI:
             return
         
         self.is_processing = True
+        self.cancel_requested.clear()
         self.progress_value.set(0)
-        
-        thread = threading.Thread(target=self.extract_text, daemon=True)
+        self.eta_text.set("")
+        self.extract_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        
+        # Reglages lus ici : le thread d'extraction ne lit pas les variables Tk
+        langs = []
+        if self.korean_enabled.get():
+            langs.append('korean')
+        if self.english_enabled.get():
+            langs.append('en')
+        try:
+            workers = max(1, self.workers.get())
+        except tk.TclError:
+            workers = 1
+        folder = Path(self.folder_path.get())
+        options = make_options(phash=self.known_bands.get(), trace=True)
+        
+        thread = threading.Thread(target=self.extract_text, args=(folder, langs, workers, options),
+                                  daemon=True)
         thread.start()
     
-    def extract_text(self):
+    def extract_text(self, folder, langs, workers, options):
+        server = None
         try:
-            self.status_text.set("⏳ Initialisation...")
+            self.post('status', "⏳ Initialisation...")
+            
+            # Les pages deja extraites (meme image, memes reglages) sortent du cache
+            if self.cache is None:
+                self.cache = OcrCache()
             
-            if self.korean_enabled.get() and self.ocr_ko is None:
-                self.ocr_ko = PaddleOCR(
-                    lang='korean',
-                    use_textline_orientation=True,
-                    text_det_thresh=0.25,
-                    text_det_box_thresh=0.55,
-                    text_det_unclip_ratio=1.6
-                )
+            # Serveur OCR local s'il tourne : ses modeles sont deja charges
+            server = connect_server()
             
-            if self.english_enabled.get() and self.ocr_en is None:
-                self.ocr_en = PaddleOCR(
-                    lang='en',
-                    use_textline_orientation=True,
-                    text_det_thresh=0.25,
-                    text_det_box_thresh=0.55,
-                    text_det_unclip_ratio=1.6
-                )
+            # Avec un seul processus, les moteurs restent charges entre deux extractions.
+            # Coreen + anglais : un seul detecteur, chaque boite va au bon reconnaisseur
+            engines = None
+            if workers == 1 and server is None:
+                loaded = self.ocr_ko or self.ocr_en
+                det = loaded.det if loaded else None
+                if 'korean' in langs and self.ocr_ko is None:
+                    self.ocr_ko = create_ocr('korean', det=det)
+                    det = self.ocr_ko.det
+                
+                if 'en' in langs and self.ocr_en is None:
+                    self.ocr_en = create_ocr('en', det=det)
+                
+                engines = {'korean': self.ocr_ko, 'en': self.ocr_en}
+                engines = {lang: engines[lang] for lang in langs}
             
-            folder = Path(self.folder_path.get())
-            images = sorted(list(folder.glob('*.jpeg')) + list(folder.glob('*.jpg')) + list(folder.glob('*.png')))
-            images = sorted(set(images))
+            # Dossier, archive ou PDF : pages lues une a une, sans extraction sur le disque
+            source = open_source(folder)
+            images = source.pages()
             
             if not images:
-                self.status_text.set("❌ Aucune image")
-                self.is_processing = False
+                self.post('status', "❌ Aucune image")
                 return
             
-            doc = Document()
-            doc.add_heading('Extraction Manhwa', 0)
-            doc.add_paragraph(f'{len(images)} pages')
-            doc.add_paragraph()
+            # Le document est enregistre regulierement pendant l'extraction
+            if folder.is_dir():
+                output = folder / f'{source.name}_extraction.docx'
+            else:
+                output = folder.with_name(f'{source.name}_extraction.docx')
+            doc = DocxWriter(output, 'Extraction Manhwa', intro=[f'{len(images)} pages'])
             
             total_bubbles = 0
             
-            for idx, img_path in enumerate(images, 1):
-                self.status_text.set(f"📄 Page {idx}/{len(images)}")
-                self.progress_value.set((idx / len(images)) * 100)
-                
-                bubbles = self.process_image(img_path)
-                total_bubbles += len(bubbles)
-                
-                doc.add_heading(f'Page {idx}', level=2)
-                
-                if bubbles:
-                    for num, text in enumerate(bubbles, 1):
-                        p = doc.add_paragraph()
-                        num_run = p.add_run(f'{num}. ')
-                        num_run.bold = True
-                        num_run.font.size = Pt(11)
-                        
-                        text_run = p.add_run(text)
-                        text_run.font.color.rgb = RGBColor(0, 0, 255)
-                        text_run.font.size = Pt(11)
+            # Reprise apres un arret : les pages deja terminees viennent du manifeste
+            self.tracer = Tracer()
+            job = ChapterJob(folder, images, job_settings(langs, options), source.job_path())
+            resumed = set(job.done)
+            if resumed:
+                self.post('status', f"↻ Reprise : {len(resumed)}/{len(images)} pages déjà faites")
+            
+            # Debit mesure sur les pages vraiment traitees (ni reprises, ni en cache)
+            progress = {'done': 0, 'fresh': 0, 'start': time.perf_counter()}
+            
+            def on_chunk(result, y_end):
+                # Thread OCR : progression dans la page, arret au morceau suivant
+                if self.cancel_requested.is_set():
+                    raise ExtractionCancelled()
+                if result['height']:
+                    done = progress['done'] + min(1.0, y_end / result['height'])
+                    self.post('progress', done / len(images) * 100)
+            
+            # Pages traitees en parallele, resultats remis dans l'ordre
+            fresh = iter_pages(job.pending(), langs, workers=workers, options=options,
+                               engines=engines, cache=self.cache, server=server, on_chunk=on_chunk)
+            
+            cancelled = False
+            try:
+                for idx, page in enumerate(job.iter_results(fresh), 1):
+                    self.tracer.add_page(page)
+                    
+                    # Lignes regroupees en bulles, en ordre de lecture (comme la CLI)
+                    with self.tracer.span('group', boxes=len(page['records'])):
+                        bubbles = group_records(page['records'])
+                    total_bubbles += len(bubbles)
+                    
+                    with self.tracer.span('write', boxes=len(bubbles)):
+                        doc.write_page(idx, page, bubbles)
                     
-                    doc.add_paragraph()
-                else:
-                    doc.add_paragraph('[Aucun texte]')
-                    doc.add_paragraph()
+                    progress['done'] = idx
+                    if idx - 1 not in resumed and not page['cached']:
+                        progress['fresh'] += 1
+                    self.post('progress', idx / len(images) * 100)
+                    self.post('status', f"📄 Page {idx}/{len(images)} — {total_bubbles} bulles")
+                    self.post('eta', self.format_eta(progress, len(images) - idx))
+                    
+                    # Serveur ou plusieurs processus : annulation entre deux pages
+                    if self.cancel_requested.is_set() and idx < len(images):
+                        cancelled = True
+                        break
+            except ExtractionCancelled:
+                cancelled = True
+            finally:
+                fresh.close()
             
-            output = folder / f'{folder.name}_extraction.docx'
-            doc.save(str(output))
+            # Document enregistre meme en cas d'annulation : les pages finies y sont
+            with self.tracer.span('save'):
+                doc.close()
             
-            self.progress_value.set(100)
-            self.status_text.set(f"✓ Terminé ! {total_bubbles} bulles")
+            if cancelled:
+                done = progress['done']
+                self.post('status', f"⏹ Annulé après {done}/{len(images)} pages — {total_bubbles} bulles")
+                self.post('info', "Annulé",
+                          f"{done}/{len(images)} pages enregistrées ({total_bubbles} bulles)\n\n"
+                          f"Fichier :\n{output}\n\nLa prochaine extraction reprendra à la page {done + 1}.")
+                return
             
-            messagebox.showinfo(
-                "Terminé !",
-                f"✓ {total_bubbles} bulles extraites\n\nFichier :\n{output}"
-            )
+            self.post('progress', 100)
+            self.post('eta', "")
+            self.post('status', f"✓ Terminé ! {total_bubbles} bulles")
+            self.post('info', "Terminé !", f"✓ {total_bubbles} bulles extraites\n\nFichier :\n{output}")
             
         except Exception as e:
-            self.status_text.set(f"❌ Erreur")
-            messagebox.showerror("Erreur", str(e))
+            self.post('status', "❌ Erreur")
+            self.post('error', "Erreur", str(e))
         
         finally:
-            self.is_processing = False
+            if server is not None:
+                server.close()
+            self.post('finished')
     
-    def process_image(self, img_path):
-        img = cv2.imread(str(img_path))
-        if img is None:
-            return []
-        
-        h, w = img.shape[:2]
-        
-        chunks = []
-        chunk_height = 3000
-        overlap = 200
-        
-        for y in range(0, h, chunk_height - overlap):
-            y_end = min(y + chunk_height, h)
-            chunk = img[y:y_end, :]
-            
-            temp_path = f'temp_chunk_{len(chunks)}.jpg'
-            cv2.imwrite(temp_path, chunk)
-            
-            preprocessed = self.light_preprocess(chunk)
-            if preprocessed is not None:
-                temp_prep = f'temp_prep_{len(chunks)}.jpg'
-                cv2.imwrite(temp_prep, preprocessed)
-                chunks.append((temp_prep, temp_path))
-            else:
-                chunks.append((temp_path, temp_path))
-        
-        all_texts = []
-        
-        for prep_path, orig_path in chunks:
-            try:
-                if self.korean_enabled.get():
-                    result = self.ocr_ko.predict(prep_path)
-                    texts = self.extract_texts(result)
-                    all_texts.extend(texts)
-                
-                if self.english_enabled.get():
-                    result = self.ocr_en.predict(prep_path)
-                    texts = self.extract_texts(result)
-                    all_texts.extend(texts)
-                
-            finally:
-                if os.path.exists(prep_path):
-                    os.remove(prep_path)
-                if os.path.exists(orig_path) and orig_path != prep_path:
-                    os.remove(orig_path)
-        
-        return all_texts
-    
-    def light_preprocess(self, img):
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8,8))
-        enhanced = clahe.apply(gray)
-        denoised = cv2.fastNlMeansDenoising(enhanced, h=7)
-        return denoised
-    
-    def extract_texts(self, result):
-        texts = []
-        
-        if result and len(result) > 0:
-            for page_result in result:
-                if 'rec_texts' in page_result:
-                    for text, score in zip(page_result['rec_texts'], page_result['rec_scores']):
-                        if score > 0.70 and text.strip() and not self.is_noise(text):
-                            texts.append(text.strip())
-        
-        return texts
-    
-    def is_noise(self, text):
-        text = text.strip()
-        if len(text) < 2:
-            return True
-        
-        if re.match(r'^[0-9<>|\.\-_~*:\'"`]+$', text):
-            return True
-        
-        if text in ['UU', 'Mdo', '00000', '|0', '::', 'H']:
-            return True
-        
-        return False
+    @staticmethod
+    def format_eta(progress, remaining):
+        '''Debit en pages/min et temps restant estime'''
+        if not progress['fresh']:
+            return ""
+        elapsed = time.perf_counter() - progress['start']
+        per_minute = progress['fresh'] / elapsed * 60
+        minutes, seconds = divmod(int(remaining / per_minute * 60), 60)
+        return f"⚡ {per_minute:.1f} pages/min — reste ~{minutes}m {seconds:02d}s"
 
 
 def main():
+    # Necessaire pour le pool de processus dans la version .exe
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = ManhwaExtractorGUI(root)
     root.mainloop()
@@ -0,0 +1,214 @@
+'''Ecriture des resultats page par page : DOCX, JSONL, Markdown
+
+Chaque format recoit les memes donnees au fur et a mesure que les pages
+sont terminees (write_page, dans l'ordre) : rien n'est garde en memoire a
+part le document Word, et les fichiers JSONL / Markdown sont lisibles
+pendant l'extraction. Le JSONL garde tout ce que le DOCX perd (boites en
+coordonnees page, scores, langue), pour les outils qui suivent.
+
+    with open_writers(folder / 'Chapitre_35_COMPLET', ['docx', 'jsonl'], 'Titre') as out:
+        for page_num, page in enumerate(results, 1):
+            out.write_page(page_num, page, group_records(page['records']))
+'''
+import json
+import os
+from pathlib import Path
+
+JSONL_VERSION = 1
+
+
+class OutputWriter:
+    '''Base des formats de sortie ; bubbles = [(texte, score moyen)]'''
+
+    suffix = ''
+
+    def __init__(self, path, title='', subtitle='', intro=()):
+        self.path = Path(path)
+        self.title = title
+        self.subtitle = subtitle
+        self.intro = list(intro)
+
+    def write_page(self, page_num, page, bubbles):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class JsonlWriter(OutputWriter):
+    '''Une ligne JSON par page, ecrite des que la page est terminee'''
+
+    suffix = '.jsonl'
+
+    def __init__(self, path, title='', subtitle='', intro=()):
+        super().__init__(path, title, subtitle, intro)
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._write({'type': 'chapter', 'version': JSONL_VERSION, 'title': self.title,
+                     'subtitle': self.subtitle})
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def write_page(self, page_num, page, bubbles):
+        self._write({
+            'type': 'page',
+            'page': page_num,
+            'name': os.path.basename(page['path']),
+            'width': page['width'],
+            'height': page['height'],
+            'chunks': page['chunks'],
+            'error': page['error'],
+            'records': [{'text': rec['text'], 'box': rec['box'],
+                         'score': round(rec['score'], 4), 'lang': rec.get('lang')}
+                        for rec in page['records']],
+            'bubbles': [{'text': text, 'score': round(score, 4)} for text, score in bubbles],
+        })
+
+    def close(self):
+        self._file.close()
+
+
+class MarkdownWriter(OutputWriter):
+    '''Liste numerotee des bulles, une section par page'''
+
+    suffix = '.md'
+
+    def __init__(self, path, title='', subtitle='', intro=()):
+        super().__init__(path, title, subtitle, intro)
+        self._file = open(self.path, 'w', encoding='utf-8')
+        lines = [f'# {self.title}', ''] if self.title else []
+        if self.subtitle:
+            lines += [f'**{self.subtitle}**', '']
+        for paragraph in self.intro:
+            lines += [paragraph, '']
+        self._file.write(''.join(line + '\n' for line in lines))
+        self._file.flush()
+
+    def write_page(self, page_num, page, bubbles):
+        if not page['height']:
+            return
+        lines = [f'## Page {page_num}', '']
+        if bubbles:
+            lines += [f'{idx}. {text}' for idx, (text, score) in enumerate(bubbles, 1)]
+        else:
+            lines.append('*[Aucun texte detecte]*')
+        self._file.write('\n'.join(lines) + '\n\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class DocxWriter(OutputWriter):
+    '''Document Word (meme mise en forme qu'avant)
+
+    Un .docx ne s'ecrit pas par morceaux : il est enregistre toutes les
+    save_every pages (fichier temporaire puis remplacement) pour qu'une
+    extraction en cours ou interrompue laisse un document lisible.
+    '''
+
+    suffix = '.docx'
+
+    def __init__(self, path, title='', subtitle='', intro=(), save_every=10):
+        from docx import Document
+
+        super().__init__(path, title, subtitle, intro)
+        self.save_every = save_every
+        self._pending = 0
+        self.doc = Document()
+        if self.title:
+            self.doc.add_heading(self.title, 0)
+        if self.subtitle:
+            self.doc.add_heading(self.subtitle, 1)
+        for paragraph in self.intro:
+            self.doc.add_paragraph(paragraph)
+        self.doc.add_paragraph()
+
+    def write_page(self, page_num, page, bubbles):
+        from docx.shared import Pt, RGBColor
+
+        if not page['height']:
+            return
+        doc = self.doc
+        doc.add_heading(f'Page {page_num}', level=2)
+
+        if bubbles:
+            for idx, (text, score) in enumerate(bubbles, 1):
+                p = doc.add_paragraph()
+
+                num_run = p.add_run(f'{idx}. ')
+                num_run.bold = True
+                num_run.font.size = Pt(11)
+
+                text_run = p.add_run(text)
+                text_run.font.color.rgb = RGBColor(0, 0, 255)
+                text_run.font.size = Pt(11)
+
+            doc.add_paragraph()
+        else:
+            doc.add_paragraph('[Aucun texte detecte]')
+            doc.add_paragraph()
+
+        self._pending += 1
+        if self.save_every and self._pending >= self.save_every:
+            self.save()
+
+    def save(self):
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        self.doc.save(str(tmp))
+        os.replace(tmp, self.path)
+        self._pending = 0
+
+    def close(self):
+        self.save()
+
+
+WRITERS = {
+    'docx': DocxWriter,
+    'jsonl': JsonlWriter,
+    'md': MarkdownWriter,
+}
+
+
+class MultiWriter(OutputWriter):
+    '''Envoie chaque page a plusieurs formats'''
+
+    def __init__(self, writers):
+        self.writers = list(writers)
+        self.path = self.writers[0].path if self.writers else None
+
+    @property
+    def paths(self):
+        return [writer.path for writer in self.writers]
+
+    def write_page(self, page_num, page, bubbles):
+        for writer in self.writers:
+            writer.write_page(page_num, page, bubbles)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+def open_writers(base, formats, title='', subtitle='', intro=()):
+    '''Un fichier par format : base + '.docx', '.jsonl', '.md' ...'''
+    unknown = set(formats) - set(WRITERS)
+    if unknown:
+        raise ValueError(f'Formats inconnus: {", ".join(sorted(unknown))}')
+    writers = []
+    try:
+        for fmt in formats:
+            cls = WRITERS[fmt]
+            writers.append(cls(Path(f'{base}{cls.suffix}'), title, subtitle, intro))
+    except Exception:
+        for writer in writers:
+            writer.close()
+        raise
+    return MultiWriter(writers)
@@ -0,0 +1,311 @@
+'''Index perceptuel des bandes deja lues (pages de credits, bannieres...)
+
+Chaque bande envoyee a l'OCR (zone de contenu entre deux gouttieres, ou
+page courte entiere) est resumee par un dHash a zone morte (les aplats
+donnent des bits stables meme apres recompression) et une vignette en
+niveaux de gris. Quand une bande revient, dans ce chapitre ou un autre,
+elle est reconnue en quelques millisecondes et son texte est repris tel
+quel au lieu d'etre relu ; une entree marquee 'skip' ne donne aucun texte
+(page de credits de l'equipe de traduction, par exemple).
+
+Le dHash ne sert qu'a trouver les candidats : la vignette compare ensuite
+les bandes bloc par bloc, pour qu'une bulle au texte different sur le meme
+decor ne soit pas confondue. Les entrees sont liees aux reglages OCR (meme
+langue, memes modeles) et rangees dans le fichier du cache OCR.
+
+    python manhwa_phash.py list
+    python manhwa_phash.py skip 12 --label "credits equipe"
+    python manhwa_phash.py prune --days 30
+'''
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+
+DHASH_SIZE = 16
+DHASH_DEADZONE = 2
+DHASH_MAX_DISTANCE = 16
+THUMB_WIDTH = 128
+THUMB_BLOCK = 8
+THUMB_MAX_DIFF = 5.0
+# Ecart de format (hauteur / largeur, en pourcents) toleree entre deux bandes
+ASPECT_TOLERANCE = 2
+BAND_MIN_HEIGHT = 64
+BAND_INDEX_MAX = 20000
+ACTIONS = ('reuse', 'skip')
+
+
+def band_signature(img):
+    '''(format, dHash, vignette) d'une bande, ou None si elle est trop petite'''
+    h, w = img.shape[:2]
+    if h < BAND_MIN_HEIGHT or w < THUMB_WIDTH:
+        return None
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    small = cv2.resize(gray, (DHASH_SIZE + 1, DHASH_SIZE), interpolation=cv2.INTER_AREA).astype(np.int16)
+    diff = small[:, 1:] - small[:, :-1]
+    bits = np.concatenate(((diff > DHASH_DEADZONE).ravel(), (diff < -DHASH_DEADZONE).ravel()))
+
+    thumb_h = max(THUMB_BLOCK, round(h * THUMB_WIDTH / w))
+    thumb = cv2.resize(gray, (THUMB_WIDTH, thumb_h), interpolation=cv2.INTER_AREA)
+    return round(h * 100 / w), np.packbits(bits).tobytes(), thumb
+
+
+def thumb_distance(a, b):
+    '''Plus grand ecart moyen d'un bloc THUMB_BLOCK x THUMB_BLOCK entre deux vignettes'''
+    h = min(a.shape[0], b.shape[0]) // THUMB_BLOCK * THUMB_BLOCK
+    w = THUMB_WIDTH // THUMB_BLOCK * THUMB_BLOCK
+    diff = np.abs(a[:h, :w].astype(np.float32) - b[:h, :w].astype(np.float32))
+    return float(diff.reshape(h // THUMB_BLOCK, THUMB_BLOCK, w // THUMB_BLOCK, THUMB_BLOCK).mean(axis=(1, 3)).max())
+
+
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+
+def _hamming(a, known):
+    '''Distances de Hamming entre le dHash a et chaque ligne de known (uint8, n x octets)'''
+    diff = known ^ np.frombuffer(a, np.uint8)
+    if hasattr(np, 'bitwise_count'):
+        # numpy >= 2.0 : popcount natif, ~6 fois plus rapide que la table
+        return np.bitwise_count(diff.view(np.uint64)).sum(axis=1)
+    return _POPCOUNT[diff].sum(axis=1)
+
+
+class BandIndex:
+    '''Bandes connues, dans une table de la base du cache OCR
+
+    Partage la connexion, le verrou et le budget en octets d'OcrCache (voir
+    OcrCache.bands) : evict est appele apres chaque ajout. Les lignes sont
+    gardees en coordonnees de bande divisees par sa largeur, pour resservir
+    une bande redimensionnee.
+    '''
+
+    def __init__(self, db, lock, evict=None):
+        self._db = db
+        self._lock = lock
+        self._evict_bytes = evict
+        # settings -> (ids, formats, dHash) deja lus, completes a chaque
+        # recherche par les bandes ajoutees depuis (ce processus ou un autre)
+        self._hashes = {}
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS bands ('
+            ' id INTEGER PRIMARY KEY,'
+            ' settings TEXT NOT NULL,'
+            ' aspect INTEGER NOT NULL,'
+            ' dhash BLOB NOT NULL,'
+            ' thumb BLOB NOT NULL,'
+            ' lines TEXT NOT NULL,'
+            " action TEXT NOT NULL DEFAULT 'reuse',"
+            " label TEXT NOT NULL DEFAULT '',"
+            ' source TEXT NOT NULL,'
+            ' hits INTEGER NOT NULL DEFAULT 0,'
+            ' created REAL NOT NULL,'
+            ' last_used REAL NOT NULL,'
+            ' size INTEGER NOT NULL DEFAULT 0)'
+        )
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(bands)')]
+        if 'size' not in columns:
+            # Table creee avant le comptage des octets
+            self._db.execute('ALTER TABLE bands ADD COLUMN size INTEGER NOT NULL DEFAULT 0')
+            self._db.execute('UPDATE bands SET size = length(dhash) + length(thumb) + length(CAST(lines AS BLOB))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS bands_lookup ON bands (settings, aspect)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS bands_last_used ON bands (last_used)')
+        self._db.commit()
+
+    def lookup(self, signature, settings):
+        '''Entree connue pour cette bande : {'id', 'action', 'lines'} ou None'''
+        aspect, dhash, thumb = signature
+        with self._lock:
+            # dHash en memoire d'abord : a format egal (morceaux pleins du
+            # decoupage fixe), toutes les bandes de l'index sont candidates ;
+            # vignette et lignes ne sont lues que pour les hash proches
+            ids, aspects, hashes = self._known_hashes(settings)
+            near = np.flatnonzero(np.abs(aspects - aspect) <= ASPECT_TOLERANCE)
+            distances = _hamming(dhash, hashes[near])
+            keep = distances <= DHASH_MAX_DISTANCE
+            near, distances = near[keep], distances[keep]
+            gone = []
+            for band_id in ids[near[np.argsort(distances, kind='stable')]].tolist():
+                row = self._db.execute('SELECT thumb, lines, action FROM bands WHERE id = ?', (band_id,)).fetchone()
+                if row is None:
+                    # Supprimee depuis (eviction, prune, autre processus)
+                    gone.append(band_id)
+                    continue
+                known_thumb, lines, action = row
+                known = cv2.imdecode(np.frombuffer(known_thumb, np.uint8), cv2.IMREAD_GRAYSCALE)
+                if thumb_distance(thumb, known) > THUMB_MAX_DIFF:
+                    continue
+                self._db.execute('UPDATE bands SET hits = hits + 1, last_used = ? WHERE id = ?',
+                                 (time.time(), band_id))
+                self._db.commit()
+                return {'id': band_id, 'action': action, 'lines': json.loads(lines)}
+            if gone:
+                keep = ~np.isin(ids, gone)
+                self._hashes[settings] = ids[keep], aspects[keep], hashes[keep]
+        return None
+
+    def _known_hashes(self, settings):
+        '''(ids, formats, dHash) des bandes de ces reglages ; appele sous le verrou'''
+        ids, aspects, hashes = self._hashes.get(settings) or (
+            np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros((0, DHASH_SIZE * DHASH_SIZE // 4), np.uint8))
+        last = int(ids[-1]) if len(ids) else 0
+        # NOT INDEXED : parcours par id, sans relire toutes les bandes de ces reglages
+        rows = self._db.execute('SELECT id, aspect, dhash FROM bands NOT INDEXED WHERE id > ? AND settings = ?'
+                                ' ORDER BY id', (last, settings)).fetchall()
+        if rows:
+            new_ids, new_aspects, new_hashes = zip(*rows)
+            ids = np.concatenate((ids, new_ids))
+            aspects = np.concatenate((aspects, new_aspects))
+            hashes = np.concatenate((hashes, np.frombuffer(b''.join(new_hashes), np.uint8).reshape(len(rows), -1)))
+            self._hashes[settings] = ids, aspects, hashes
+        return ids, aspects, hashes
+
+    def add(self, signature, settings, lines, width, source):
+        '''Enregistre une bande lue par l'OCR ; lines = [(texte, score, box, langue)]'''
+        aspect, dhash, thumb = signature
+        scaled = [(text, score, [round(v / width, 5) for v in box], lang) for text, score, box, lang in lines]
+        ok, png = cv2.imencode('.png', thumb)
+        blob = json.dumps(scaled, ensure_ascii=False)
+        size = len(dhash) + len(png) + len(blob.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO bands (settings, aspect, dhash, thumb, lines, source, created, last_used, size)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (settings, aspect, dhash, png.tobytes(), blob, str(source), now, now, size))
+            self._evict()
+            if self._evict_bytes is not None:
+                self._evict_bytes()
+            self._db.commit()
+
+    def _evict(self):
+        '''Au-dela de BAND_INDEX_MAX entrees : les bandes jamais revues d'abord'''
+        count = self._db.execute('SELECT COUNT(*) FROM bands').fetchone()[0]
+        if count > BAND_INDEX_MAX:
+            self._db.execute(
+                'DELETE FROM bands WHERE id IN (SELECT id FROM bands'
+                " WHERE action = 'reuse' ORDER BY hits > 0, last_used LIMIT ?)",
+                (count - BAND_INDEX_MAX,))
+
+    def entries(self, min_hits=0, limit=None):
+        '''[{id, aspect, action, label, source, hits, created, last_used, text}]'''
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, aspect, action, label, source, hits, created, last_used, lines FROM bands'
+                ' WHERE hits >= ? ORDER BY hits DESC, last_used DESC LIMIT ?',
+                (min_hits, -1 if limit is None else limit)).fetchall()
+        keys = ('id', 'aspect', 'action', 'label', 'source', 'hits', 'created', 'last_used')
+        return [dict(zip(keys, row[:-1]), text=' '.join(line[0] for line in json.loads(row[-1])))
+                for row in rows]
+
+    def thumbnail(self, band_id):
+        '''Vignette PNG (octets) d'une entree, ou None'''
+        with self._lock:
+            row = self._db.execute('SELECT thumb FROM bands WHERE id = ?', (band_id,)).fetchone()
+        return row and row[0]
+
+    def update(self, band_ids, action=None, label=None):
+        if action is not None and action not in ACTIONS:
+            raise ValueError(f'Action inconnue: {action}')
+        with self._lock:
+            for band_id in band_ids:
+                if action is not None:
+                    self._db.execute('UPDATE bands SET action = ? WHERE id = ?', (action, band_id))
+                if label is not None:
+                    self._db.execute('UPDATE bands SET label = ? WHERE id = ?', (label, band_id))
+            self._db.commit()
+
+    def delete(self, band_ids):
+        with self._lock:
+            self._db.executemany('DELETE FROM bands WHERE id = ?', [(band_id,) for band_id in band_ids])
+            self._db.commit()
+
+    def prune(self, days=None, keep_seen=True):
+        '''Supprime les entrees 'reuse' inutilisees depuis days jours
+
+        keep_seen=True garde celles qui ont deja servi au moins une fois ;
+        les entrees 'skip', posees a la main, ne sont jamais supprimees ici.
+        '''
+        cutoff = time.time() - (days or 0) * 86400
+        query = "DELETE FROM bands WHERE action = 'reuse' AND last_used < ?"
+        if keep_seen:
+            query += ' AND hits = 0'
+        with self._lock:
+            removed = self._db.execute(query, (cutoff,)).rowcount
+            self._db.commit()
+        return removed
+
+    def stats(self):
+        with self._lock:
+            count, seen, skipped, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(hits > 0), 0), COALESCE(SUM(action = 'skip'), 0),"
+                ' COALESCE(SUM(size), 0) FROM bands').fetchone()
+        return {'bands': count, 'seen_again': seen, 'skip': skipped, 'bytes': size}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Bandes connues (pages de credits, bannieres...)')
+    parser.add_argument('--cache', default=None, help='Fichier de cache OCR (defaut: cache utilisateur)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    show = sub.add_parser('list', help='Entrees, les plus souvent revues d\'abord')
+    show.add_argument('--min-hits', type=int, default=1,
+                      help='Seulement les bandes revues au moins ce nombre de fois (0 = toutes)')
+    show.add_argument('--limit', type=int, default=50)
+
+    for action in ACTIONS:
+        cmd = sub.add_parser(action, help='Ne plus lire ces bandes' if action == 'skip'
+                             else 'Reprendre le texte deja lu (defaut)')
+        cmd.add_argument('ids', type=int, nargs='+')
+        cmd.add_argument('--label', default=None, help='Nom de l\'entree')
+
+    delete = sub.add_parser('delete', help='Oublier des entrees')
+    delete.add_argument('ids', type=int, nargs='+')
+
+    thumb = sub.add_parser('thumb', help='Enregistrer la vignette d\'une entree')
+    thumb.add_argument('id', type=int)
+    thumb.add_argument('output', help='Fichier PNG')
+
+    prune = sub.add_parser('prune', help='Supprimer les entrees inutilisees')
+    prune.add_argument('--days', type=int, default=30, help='Inutilisees depuis ce nombre de jours')
+    prune.add_argument('--all', action='store_true', help='Meme celles deja revues')
+    return parser.parse_args()
+
+
+def main():
+    from manhwa_cache import OcrCache
+
+    args = parse_args()
+    cache = OcrCache(args.cache)
+    index = cache.bands
+
+    if args.command == 'list':
+        stats = index.stats()
+        print(f'{stats["bands"]} bandes, {stats["seen_again"]} revues, {stats["skip"]} ignorees, '
+              f'{stats["bytes"] / 2**20:.1f} Mo ({cache.path})')
+        print(f'{"id":>6} {"vues":>5} {"action":<6} {"derniere":<16} {"libelle / texte":<40} source')
+        for entry in index.entries(args.min_hits, args.limit):
+            last = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used']))
+            name = entry['label'] or entry['text'] or '[sans texte]'
+            print(f'{entry["id"]:>6} {entry["hits"]:>5} {entry["action"]:<6} {last:<16} '
+                  f'{name[:40]:<40} {entry["source"]}')
+    elif args.command in ACTIONS:
+        index.update(args.ids, args.command, args.label)
+    elif args.command == 'delete':
+        index.delete(args.ids)
+    elif args.command == 'thumb':
+        png = index.thumbnail(args.id)
+        if png is None:
+            raise SystemExit(f'Entree inconnue: {args.id}')
+        with open(args.output, 'wb') as f:
+            f.write(png)
+    elif args.command == 'prune':
+        removed = index.prune(args.days, keep_seen=not args.all)
+        print(f'{removed} entrees supprimees')
+    cache.close()
+
+
+if __name__ == '__main__':
+    main()
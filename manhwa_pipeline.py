@@ -0,0 +1,167 @@
+'''Pipeline en flux : lecture -> pretraitement -> OCR -> ecriture
+
+Chaque etape tourne dans ses propres threads et communique par des files
+bornees : la lecture (reseau lent) et le pretraitement (CLAHE, debruitage)
+avancent pendant que l'OCR travaille, et au plus `prefetch` pages attendent
+entre deux etapes, donc la memoire reste stable sur les longs chapitres.
+Les tres longues pages PNG (TiledChunks) ne sont decodees et pretraitees
+qu'au moment de l'OCR, morceau par morceau.
+'''
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from manhwa_core import (read_bytes, prepare_chunks, recognize_pages, new_page_result,
+                         make_options, recognition_units)
+from manhwa_trace import trace_event
+
+PREFETCH = 4
+IO_THREADS = 2
+PREP_THREADS = 2
+
+_DONE = object()
+
+
+def _timed_read(path):
+    start = time.perf_counter()
+    data = read_bytes(path)
+    return data, time.perf_counter() - start
+
+
+def _put(q, item, stop):
+    '''put() bloquant qui abandonne si le pipeline est arrete'''
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def iter_pages_pipelined(paths, engines, options=None, prefetch=PREFETCH,
+                         io_threads=IO_THREADS, prep_threads=PREP_THREADS,
+                         rec_batch_pages=1, batched=True, cache=None, on_chunk=None):
+    '''Meme resultat que extract_page pour chaque page, dans l'ordre
+
+    La boucle de l'appelant (ecriture du DOCX) tourne en parallele de l'OCR
+    de la page suivante. rec_batch_pages > 1 regroupe la reconnaissance des
+    lignes de plusieurs pages (voir recognize_pages). Avec un cache, les
+    pages deja connues ne sont ni decodees ni envoyees a l'OCR.
+    on_chunk : voir recognize_pages ; une ExtractionCancelled qu'il leve
+    arrete le pipeline et est relancee ici, sans rendre la page en cours.
+    Une page illisible devient une page en erreur (result['error']) ; toute
+    autre exception d'une etape passe d'une file a l'autre jusqu'ici, ou
+    elle est relancee : l'appelant n'attend jamais un thread mort.
+    '''
+    options = make_options(**(options or {}))
+    units = recognition_units(engines, options)
+    stop = threading.Event()
+    read_q = queue.Queue(maxsize=prefetch)
+    prep_q = queue.Queue(maxsize=prefetch)
+    out_q = queue.Queue(maxsize=prefetch)
+    io_pool = ThreadPoolExecutor(io_threads, thread_name_prefix='lecture')
+    prep_pool = ThreadPoolExecutor(prep_threads, thread_name_prefix='pretraitement')
+
+    def read_stage():
+        try:
+            for path in paths:
+                if not _put(read_q, (path, io_pool.submit(_timed_read, path)), stop):
+                    return
+        except Exception as e:
+            _put(read_q, e, stop)
+            return
+        _put(read_q, _DONE, stop)
+
+    def prep_stage():
+        try:
+            prep_loop()
+        except Exception as e:
+            _put(prep_q, e, stop)
+
+    def prep_loop():
+        while True:
+            item = _get(read_q, stop)
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            path, read_future = item
+            try:
+                data, read_seconds = read_future.result()
+            except Exception as e:
+                # Lecture ratee : la page sort en erreur, les suivantes continuent
+                future, read_seconds, data = Future(), 0.0, None
+                future.set_exception(e)
+            else:
+                future = prep_pool.submit(prepare_chunks, path, options, data, cache, units)
+            size = 0 if data is None else len(data)
+            if not _put(prep_q, (path, future, read_seconds, size), stop):
+                return
+        _put(prep_q, _DONE, stop)
+
+    def ocr_stage():
+        try:
+            ocr_loop()
+        except Exception as e:
+            # ExtractionCancelled ou panne d'une etape : relancee par l'appelant
+            _put(out_q, e, stop)
+
+    def ocr_loop():
+        finished = False
+        while not finished:
+            batch = []
+            while len(batch) < rec_batch_pages:
+                item = _get(prep_q, stop)
+                if item is _DONE:
+                    finished = True
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                path, future, read_seconds, size = item
+                try:
+                    result, chunks = future.result()
+                except Exception as e:
+                    result, chunks = new_page_result(path, str(e), options), None
+                result['timings']['read'] = read_seconds
+                if result['trace'] is not None:
+                    result['trace'].append(trace_event('read', read_seconds, bytes=size))
+                batch.append((result, chunks))
+
+            if batch:
+                recognize_pages(batch, engines, batched, cache=cache, on_chunk=on_chunk)
+            for result, chunks in batch:
+                if not _put(out_q, result, stop):
+                    return
+            del batch
+        _put(out_q, _DONE, stop)
+
+    threads = [threading.Thread(target=stage, daemon=True)
+               for stage in (read_stage, prep_stage, ocr_stage)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            result = _get(out_q, stop)
+            if result is _DONE:
+                break
+            if isinstance(result, Exception):
+                raise result
+            yield result
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        io_pool.shutdown(wait=True, cancel_futures=True)
+        prep_pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,148 @@
+'''Extraction de pages en parallele : un moteur PaddleOCR par processus'''
+import multiprocessing as mp
+import os
+
+# Bibliotheques de calcul qui lisent leur nombre de threads au chargement
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+)
+
+_engines = None
+_options = None
+_batched = True
+_cache = None
+
+
+def default_workers():
+    '''Nombre de processus par defaut : ~4 threads par processus'''
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+def default_threads(workers):
+    '''Partage les coeurs entre les processus sans depasser la machine'''
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _init_worker(langs, threads, options, batched, cache_args):
+    '''Charge les modeles une seule fois par processus'''
+    global _engines, _options, _batched, _cache
+
+    # Variables THREAD_ENV_VARS deja posees par PagePool : avec spawn, le
+    # script principal (cv2, numpy) est reimporte avant cet initializer
+    import cv2
+    cv2.setNumThreads(threads)
+
+    from manhwa_core import create_engines
+    _engines = create_engines(langs, cpu_threads=threads)
+    _options = options
+    _batched = batched
+
+    # Chaque processus ouvre sa propre connexion au cache SQLite
+    if cache_args is not None:
+        from manhwa_cache import OcrCache
+        _cache = OcrCache(*cache_args)
+
+
+def _page_job(img_path):
+    from manhwa_core import extract_page, new_page_result
+    try:
+        return extract_page(img_path, _engines, _options, _batched, _cache)
+    except Exception as e:
+        return new_page_result(img_path, str(e), _options)
+
+
+class PagePool:
+    '''Pool de processus OCR ; les resultats reviennent dans l'ordre des pages
+
+    S'utilise en contexte :
+        with PagePool(['korean'], workers=4) as pool:
+            for result in pool.imap(images): ...
+    '''
+
+    def __init__(self, langs, workers=None, threads=None, options=None, batched=True,
+                 cache=None):
+        self.workers = workers or default_workers()
+        self.threads = threads or default_threads(self.workers)
+
+        cache_args = None if cache is None else (str(cache.path), cache.max_bytes)
+
+        # spawn : pas de fork d'un processus qui a deja des threads Paddle.
+        # Les processus heritent de l'environnement a leur lancement, avant
+        # tout import : seul moment ou OpenBLAS / MKL / OpenMP le lisent
+        saved = {var: os.environ.get(var) for var in THREAD_ENV_VARS}
+        os.environ.update({var: str(self.threads) for var in THREAD_ENV_VARS})
+        try:
+            ctx = mp.get_context('spawn')
+            self._pool = ctx.Pool(
+                self.workers,
+                initializer=_init_worker,
+                initargs=(list(langs), self.threads, options, batched, cache_args),
+            )
+        finally:
+            for var, value in saved.items():
+                if value is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = value
+
+    def imap(self, paths):
+        return self._pool.imap(_page_job, [str(p) for p in paths], chunksize=1)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+def iter_pages(paths, langs, workers=1, threads=None, options=None, engines=None,
+               prefetch=None, rec_batch_pages=1, batched=True, cache=None, server=None,
+               pool=None, on_chunk=None):
+    '''Resultats de extract_page pour chaque page, dans l'ordre
+
+    workers=1 : OCR dans le processus courant (engines reutilises s'ils sont
+    fournis), lecture et pretraitement en avance dans le pipeline, lignes de
+    rec_batch_pages pages reconnues ensemble.
+    workers>1 : PagePool (reconnaissance regroupee page par page).
+    options : reglages d'extraction (voir manhwa_core.make_options).
+    cache : OcrCache partage (chaque processus du pool rouvre le meme fichier).
+    server : client du serveur OCR local (manhwa_server.connect_server) ; s'il
+    est fourni, tout l'OCR y est fait avec ses moteurs deja charges.
+    pool : PagePool deja demarre, reutilise d'un chapitre a l'autre (ses
+    options et son cache sont ceux donnes a sa creation).
+    on_chunk(result, y_end) : progression morceau par morceau, seulement avec
+    workers=1 sans serveur (voir manhwa_core.recognize_pages) ; ailleurs la
+    progression et l'annulation se font page par page.
+    '''
+    if server is not None:
+        yield from server.iter_pages(paths, langs, options, prefetch, rec_batch_pages, batched, cache)
+        return
+    if pool is not None:
+        yield from pool.imap(paths)
+        return
+
+    if workers <= 1:
+        from manhwa_core import create_engines
+        from manhwa_pipeline import iter_pages_pipelined, PREFETCH
+        if engines is None:
+            engines = create_engines(langs, cpu_threads=threads)
+        yield from iter_pages_pipelined(paths, engines, options, prefetch or PREFETCH,
+                                        rec_batch_pages=rec_batch_pages, batched=batched, cache=cache,
+                                        on_chunk=on_chunk)
+        return
+
+    with PagePool(langs, workers, threads, options, batched, cache) as pool:
+        yield from pool.imap(paths)
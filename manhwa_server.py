@@ -0,0 +1,237 @@
+'''Serveur OCR local : les modeles restent charges entre deux extractions
+
+    python manhwa_server.py --langs korean en
+
+Le serveur ecoute sur localhost et publie son adresse (et une cle
+d'authentification aleatoire) dans server.json du dossier de cache
+utilisateur. Les scripts CLI et la GUI s'y connectent automatiquement
+(connect_server) ; s'il ne tourne pas, ils chargent leurs propres modeles.
+
+Protocole (multiprocessing.connection) : le client envoie (type, params),
+le serveur repond par une suite de ('page', result) puis ('done', None),
+ou ('error', message). Un seul travail OCR a la fois ; les autres clients
+attendent leur tour.
+'''
+import argparse
+import json
+import os
+import secrets
+import threading
+from multiprocessing.connection import Client, Listener
+
+from manhwa_cache import OcrCache, default_cache_dir
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 47615
+SERVER_FILENAME = 'server.json'
+CONNECT_TIMEOUT = 2.0
+
+
+def server_info_path():
+    return default_cache_dir() / SERVER_FILENAME
+
+
+def read_server_info():
+    '''Adresse et cle du serveur en cours, ou None'''
+    try:
+        with open(server_info_path(), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class OcrServer:
+    '''Moteurs charges une fois, partages par toutes les connexions'''
+
+    def __init__(self, langs=('korean',), threads=None, host=SERVER_HOST, port=SERVER_PORT):
+        self.threads = threads
+        self.address = (host, port)
+        self.authkey = secrets.token_bytes(16)
+        self._engines = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+        self.engines(langs)
+
+    def engines(self, langs):
+        '''Moteurs des langues demandees, charges a la premiere demande'''
+        from manhwa_core import create_ocr
+        for lang in langs:
+            if lang not in self._engines:
+                det = next(iter(self._engines.values())).det if self._engines else None
+                print(f'Chargement du moteur {lang}...')
+                self._engines[lang] = create_ocr(lang, self.threads, det)
+        return {lang: self._engines[lang] for lang in langs}
+
+    def cache(self, cache_args):
+        if cache_args is None:
+            return None
+        path = cache_args[0]
+        if path not in self._caches:
+            self._caches[path] = OcrCache(*cache_args)
+        return self._caches[path]
+
+    def _pages(self, params):
+        from manhwa_pipeline import iter_pages_pipelined, PREFETCH
+        yield from iter_pages_pipelined(
+            params['paths'], self.engines(params['langs']), params.get('options'),
+            params.get('prefetch') or PREFETCH,
+            rec_batch_pages=params.get('rec_batch_pages', 1),
+            batched=params.get('batched', True),
+            cache=self.cache(params.get('cache')),
+        )
+
+    def handle(self, conn):
+        '''Sert les requetes d'un client jusqu'a sa deconnexion'''
+        jobs = {'pages': self._pages}
+        try:
+            while True:
+                kind, params = conn.recv()
+                if kind == 'ping':
+                    conn.send(('done', {'pid': os.getpid(), 'langs': list(self._engines)}))
+                    continue
+                if kind not in jobs:
+                    conn.send(('error', f'Requete inconnue: {kind}'))
+                    continue
+
+                with self._lock:
+                    results = jobs[kind](params)
+                    try:
+                        for result in results:
+                            conn.send(('page', result))
+                    except (OSError, EOFError):
+                        raise
+                    except Exception as e:
+                        conn.send(('error', str(e)))
+                        continue
+                    finally:
+                        results.close()
+                conn.send(('done', None))
+        except (OSError, EOFError):
+            # Client parti (fin normale ou extraction annulee)
+            pass
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        info_path = server_info_path()
+        info_path.parent.mkdir(parents=True, exist_ok=True)
+
+        with Listener(self.address, authkey=self.authkey) as listener:
+            host, port = listener.address
+            tmp = info_path.with_suffix('.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'host': host, 'port': port, 'authkey': self.authkey.hex(),
+                           'pid': os.getpid()}, f)
+            os.replace(tmp, info_path)
+            print(f'Serveur OCR pret sur {host}:{port} ({", ".join(self._engines)})')
+
+            try:
+                while True:
+                    try:
+                        conn = listener.accept()
+                    except Exception:
+                        # Client qui n'a pas la bonne cle
+                        continue
+                    threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+            finally:
+                info = read_server_info()
+                if info and info.get('pid') == os.getpid():
+                    info_path.unlink()
+
+
+class ServerClient:
+    '''Connexion a un serveur OCR local (voir connect_server)'''
+
+    def __init__(self, conn, info):
+        self._conn = conn
+        self.info = info
+
+    def _request(self, kind, params):
+        self._conn.send((kind, params))
+        while True:
+            status, payload = self._conn.recv()
+            if status == 'error':
+                raise RuntimeError(payload)
+            if status == 'done':
+                return payload
+            yield payload
+
+    def ping(self):
+        '''Etat du serveur : {'pid', 'langs'} (moteurs deja charges)'''
+        self._conn.send(('ping', None))
+        status, payload = self._conn.recv()
+        return payload
+
+    def iter_pages(self, paths, langs, options=None, prefetch=None, rec_batch_pages=1,
+                   batched=True, cache=None):
+        '''Meme resultat que manhwa_pool.iter_pages, calcule par le serveur
+
+        Une connexion abandonnee en cours de route (generateur ferme) est
+        fermee : le serveur arrete alors le travail en cours.
+        '''
+        params = {
+            # Le serveur n'a pas le meme dossier courant
+            'paths': [os.path.abspath(p) for p in paths],
+            'langs': list(langs),
+            'options': options,
+            'prefetch': prefetch,
+            'rec_batch_pages': rec_batch_pages,
+            'batched': batched,
+            'cache': None if cache is None else (str(cache.path), cache.max_bytes),
+        }
+        finished = False
+        try:
+            yield from self._request('pages', params)
+            finished = True
+        finally:
+            if not finished:
+                self.close()
+
+    def close(self):
+        self._conn.close()
+
+
+def connect_server():
+    '''Client connecte au serveur OCR local, ou None s'il ne tourne pas'''
+    info = read_server_info()
+    if info is None:
+        return None
+
+    import socket
+    # Adresse publiee par un serveur arrete brutalement : on n'attend pas
+    try:
+        socket.create_connection((info['host'], info['port']), CONNECT_TIMEOUT).close()
+        conn = Client((info['host'], info['port']), authkey=bytes.fromhex(info['authkey']))
+    except (OSError, EOFError, ValueError, KeyError):
+        return None
+    client = ServerClient(conn, info)
+    try:
+        client.ping()
+    except (OSError, EOFError, RuntimeError):
+        client.close()
+        return None
+    return client
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serveur OCR local (modeles gardes en memoire)')
+    parser.add_argument('--langs', nargs='+', choices=['korean', 'en'], default=['korean'],
+                        help='Moteurs charges au demarrage (les autres le sont a la demande)')
+    parser.add_argument('-t', '--threads', type=int, default=None,
+                        help='Threads de calcul du moteur (defaut: tous les coeurs)')
+    parser.add_argument('--port', type=int, default=SERVER_PORT,
+                        help='Port local (0 = choisi par le systeme)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = OcrServer(args.langs, args.threads, port=args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nServeur arrete')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+'''Sources de pages : dossier d'images, archive CBZ/ZIP ou PDF
+
+Une source donne la liste de ses pages (ordre naturel : 9.jpg avant
+10.jpg) sous forme de references texte, qui circulent comme des chemins
+(pool de processus, serveur local, manifeste de reprise) :
+
+    dossier    P:\\Serie\\Chapitre 35\\001.jpg
+    archive    P:\\Serie\\Chapitre 35.cbz::images/001.jpg
+    PDF        P:\\Serie\\Chapitre 35.pdf::page_0001_200dpi.png
+
+read_page(ref) lit une seule page a la demande : membre d'archive
+decompresse en memoire, page de PDF rendue seule (pdf2image) a la
+resolution de la reference. Rien n'est extrait sur le disque et le
+pipeline ne garde que quelques pages d'avance, meme pour un PDF de 300
+pages.
+'''
+import functools
+import io
+import os
+import re
+import zipfile
+from pathlib import Path
+
+IMAGE_SUFFIXES = ('.jpeg', '.jpg', '.png')
+ARCHIVE_SUFFIXES = ('.cbz', '.zip')
+PDF_SUFFIXES = ('.pdf',)
+PDF_DPI = 200
+# Separateur fichier source / page dans une reference
+REF_SEP = '::'
+PDF_PAGE = re.compile(r'page_(\d+)_(\d+)dpi\.png$')
+# Archives gardees ouvertes (lecture des pages une a une)
+OPEN_ARCHIVES = 4
+
+
+def natural_key(name):
+    '''Chapitre 9 avant Chapitre 10'''
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', str(name))]
+
+
+def split_ref(ref):
+    '''(fichier source, page) ; page vaut None pour une image sur disque'''
+    ref = str(ref)
+    container, sep, member = ref.rpartition(REF_SEP)
+    if not sep:
+        return ref, None
+    return container, member
+
+
+def page_name(ref):
+    '''Nom court d'une page (affichage, manifeste de reprise)'''
+    container, member = split_ref(ref)
+    return os.path.basename(member.replace('\\', '/') if member is not None else container)
+
+
+def page_stamp(ref):
+    '''Taille + date du fichier qui contient la page : detecte un remplacement'''
+    st = os.stat(split_ref(ref)[0])
+    return [st.st_size, st.st_mtime_ns]
+
+
+@functools.lru_cache(maxsize=OPEN_ARCHIVES)
+def _open_archive(path, stamp):
+    # stamp dans la cle : une archive remplacee est rouverte
+    return zipfile.ZipFile(path)
+
+
+def read_page(ref):
+    '''Octets encodes d'une page (comme le fichier image), ou None
+
+    Toute erreur de lecture rend None : la page sort en erreur et les
+    suivantes sont lues normalement.
+    '''
+    container, member = split_ref(ref)
+    try:
+        if member is None:
+            with open(container, 'rb') as f:
+                return f.read()
+        if container.lower().endswith(PDF_SUFFIXES):
+            return _render_pdf_page(container, member)
+        archive = _open_archive(container, tuple(page_stamp(ref)))
+        # Le serveur local normalise les chemins (os.path.abspath) : / redevient \ sous Windows
+        return archive.read(member.replace('\\', '/'))
+    except Exception:
+        # Fichier absent, membre corrompu (zlib.error), chiffre ou compresse
+        # autrement (RuntimeError, NotImplementedError), PDF illisible ou
+        # Poppler absent (exceptions de pdf2image)
+        return None
+
+
+def _render_pdf_page(path, member):
+    from pdf2image import convert_from_path
+
+    match = PDF_PAGE.search(member)
+    if match is None:
+        return None
+    page, dpi = int(match.group(1)), int(match.group(2))
+    images = convert_from_path(path, dpi=dpi, first_page=page, last_page=page)
+    if not images:
+        return None
+    out = io.BytesIO()
+    # PNG peu compresse : il est decode aussitot apres
+    images[0].save(out, format='PNG', compress_level=1)
+    return out.getvalue()
+
+
+class PageSource:
+    '''Pages d'un chapitre ; path : dossier ou fichier source'''
+
+    suffixes = ()
+
+    def __init__(self, path, dpi=PDF_DPI):
+        self.path = Path(path).absolute()
+        self.dpi = dpi
+
+    @property
+    def name(self):
+        '''Nom du chapitre (titre des documents)'''
+        return self.path.stem
+
+    def pages(self):
+        '''References des pages, dans l'ordre naturel'''
+        raise NotImplementedError
+
+    def output_base(self):
+        '''Chemin des fichiers de sortie, sans extension (a cote du fichier source)'''
+        return self.path.with_name(f'{self.name.replace(" ", "_")}_COMPLET')
+
+    def job_path(self):
+        '''Manifeste de reprise (voir manhwa_checkpoint) propre a cette source'''
+        return self.path.with_name(f'.{self.path.name}.manhwa_job.jsonl')
+
+
+class FolderSource(PageSource):
+    '''Images d'un dossier ; sorties et manifeste dans le dossier lui-meme'''
+
+    @property
+    def name(self):
+        return self.path.name
+
+    def pages(self):
+        return [str(p) for p in sorted(self.path.iterdir(), key=lambda p: natural_key(p.name))
+                if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES]
+
+    def output_base(self):
+        return self.path / f'{self.name.replace(" ", "_")}_COMPLET'
+
+    def job_path(self):
+        return None
+
+
+class ArchiveSource(PageSource):
+    '''Images d'une archive CBZ / ZIP (sous-dossiers compris)'''
+
+    suffixes = ARCHIVE_SUFFIXES
+
+    def pages(self):
+        with zipfile.ZipFile(self.path) as archive:
+            members = [info.filename for info in archive.infolist()
+                       if not info.is_dir() and Path(info.filename).suffix.lower() in IMAGE_SUFFIXES
+                       and not info.filename.startswith('__MACOSX/')]
+        return [f'{self.path}{REF_SEP}{member}' for member in sorted(members, key=natural_key)]
+
+
+class PdfSource(PageSource):
+    '''Pages d'un PDF, rendues une a une a self.dpi'''
+
+    suffixes = PDF_SUFFIXES
+
+    def pages(self):
+        from pdf2image import pdfinfo_from_path
+
+        count = int(pdfinfo_from_path(str(self.path))['Pages'])
+        return [f'{self.path}{REF_SEP}page_{page:04d}_{self.dpi}dpi.png' for page in range(1, count + 1)]
+
+
+SOURCES = (ArchiveSource, PdfSource)
+
+
+def is_source_file(path):
+    '''Archive ou PDF lisible comme un chapitre'''
+    return Path(path).suffix.lower() in ARCHIVE_SUFFIXES + PDF_SUFFIXES
+
+
+def open_source(path, dpi=PDF_DPI):
+    '''Source adaptee au chemin : dossier, archive ou PDF'''
+    path = Path(path)
+    if path.is_dir():
+        return FolderSource(path, dpi)
+    for cls in SOURCES:
+        if path.suffix.lower() in cls.suffixes:
+            return cls(path, dpi)
+    raise ValueError(f'Source de pages inconnue: {path} (dossier, {", ".join(ARCHIVE_SUFFIXES + PDF_SUFFIXES)})')
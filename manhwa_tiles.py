@@ -0,0 +1,133 @@
+'''Lecture par bandes des tres longues pages PNG (memoire bornee)
+
+Une bande webtoon de 720x80000 decodee d'un coup pese ~170 Mo, plus les
+copies du pretraitement. PngRowReader decompresse le flux IDAT au fil de
+l'eau et ne decode que les lignes demandees :
+
+    reader = PngRowReader(data)
+    while (band := reader.read(3000)) is not None:
+        ...
+
+Chaque bande est redecodee par Pillow sous forme d'un petit PNG : ses
+lignes filtrees telles quelles, precedees de la derniere ligne brute de la
+bande precedente (filtre 'None') pour que les filtres Up / Average / Paeth
+de la premiere ligne restent justes. Seuls les PNG 8 bits non entrelaces
+sont lus ainsi (le cas des webtoons) ; png_info retourne None pour le reste,
+qui est decode en entier comme avant.
+'''
+import io
+import struct
+import zlib
+
+import cv2
+import numpy as np
+from PIL import Image
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Octets par pixel selon le type de couleur (profondeur 8 bits)
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# Blocs recopies dans le PNG de chaque bande (palette, transparence)
+PNG_KEPT_CHUNKS = (b'PLTE', b'tRNS')
+# Octets decompresses a la fois
+INFLATE_STEP = 1 << 20
+
+
+def _chunks(data, pos=len(PNG_SIGNATURE)):
+    '''(type, debut, fin) des blocs PNG a partir de pos'''
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack_from('>I4s', data, pos)
+        start = pos + 8
+        yield kind, start, start + length
+        if kind == b'IEND':
+            return
+        pos = start + length + 4
+
+
+def png_info(data):
+    '''(largeur, hauteur) d'un PNG lisible par bandes, sinon None'''
+    data = memoryview(data).cast('B')
+    if bytes(data[:8]) != PNG_SIGNATURE or len(data) < 33:
+        return None
+    kind, start, end = next(_chunks(data))
+    if kind != b'IHDR':
+        return None
+    w, h, depth, color, _, _, interlace = struct.unpack_from('>IIBBBBB', data, start)
+    if depth != 8 or interlace or color not in PNG_CHANNELS:
+        return None
+    return w, h
+
+
+def _png_chunk(kind, payload):
+    return (struct.pack('>I', len(payload)) + kind + payload
+            + struct.pack('>I', zlib.crc32(kind + payload) & 0xffffffff))
+
+
+class PngRowReader:
+    '''Lignes successives d'un PNG 8 bits non entrelace, decodees a la demande
+
+    read(n) retourne les n lignes suivantes en BGR (niveaux de gris : 2-D),
+    comme cv2.imdecode(..., IMREAD_COLOR) sans la couche alpha, ou None a
+    la fin de l'image.
+    '''
+
+    def __init__(self, data):
+        self._data = memoryview(data).cast('B')
+        if png_info(self._data) is None:
+            raise ValueError('PNG non lisible par bandes')
+
+        chunks = _chunks(self._data)
+        _, start, end = next(chunks)
+        self._ihdr = bytes(self._data[start:end])
+        self.width, self.height, _, self._color = struct.unpack_from('>IIBB', self._ihdr)
+        self._stride = 1 + self.width * PNG_CHANNELS[self._color]
+
+        self._extra = b''.join(_png_chunk(kind, bytes(self._data[start:end]))
+                               for kind, start, end in chunks if kind in PNG_KEPT_CHUNKS)
+        self._idat = ((start, end) for kind, start, end in _chunks(self._data) if kind == b'IDAT')
+        self._inflate = zlib.decompressobj()
+        self._pending = b''
+        self._buffer = bytearray()
+        self._prev = None
+        self.y = 0
+
+    def _fill(self, size):
+        '''Remplit le tampon jusqu'a size octets filtres (ou la fin du flux)'''
+        while len(self._buffer) < size:
+            if not self._pending:
+                span = next(self._idat, None)
+                if span is None:
+                    self._buffer += self._inflate.flush()
+                    return
+                self._pending = self._data[span[0]:span[1]]
+            self._buffer += self._inflate.decompress(self._pending, INFLATE_STEP)
+            self._pending = self._inflate.unconsumed_tail
+
+    def read(self, rows):
+        rows = min(rows, self.height - self.y)
+        if rows <= 0:
+            return None
+        self._fill(rows * self._stride)
+        if len(self._buffer) < rows * self._stride:
+            raise ValueError(f'PNG tronque a la ligne {self.y + len(self._buffer) // self._stride}')
+
+        filtered = bytes(self._buffer[:rows * self._stride])
+        del self._buffer[:rows * self._stride]
+
+        header = b'' if self._prev is None else b'\x00' + self._prev
+        ihdr = struct.pack('>II', self.width, rows + (self._prev is not None)) + self._ihdr[8:]
+        png = (PNG_SIGNATURE + _png_chunk(b'IHDR', ihdr) + self._extra
+               + _png_chunk(b'IDAT', zlib.compress(header + filtered, 0)) + _png_chunk(b'IEND', b''))
+
+        with Image.open(io.BytesIO(png)) as img:
+            img.load()
+            raw = np.asarray(img)
+            self._prev = raw[-1].tobytes()
+            if img.mode == 'L':
+                band = raw
+            elif img.mode == 'RGB':
+                band = cv2.cvtColor(raw, cv2.COLOR_RGB2BGR)
+            else:
+                band = cv2.cvtColor(np.asarray(img.convert('RGB')), cv2.COLOR_RGB2BGR)
+
+        self.y += rows
+        return band[1:] if header else band
@@ -0,0 +1,90 @@
+'''Traces d'execution : ou passe le temps d'une extraction
+
+Les evenements sont au format "complete" de Chrome trace (ph='X', ts et
+dur en microsecondes) : un fichier .json s'ouvre dans chrome://tracing ou
+https://ui.perfetto.dev, tout autre nom donne un evenement JSON par ligne.
+
+Les evenements d'une page (lecture, pretraitement, detection par morceau,
+reconnaissance) sont accumules dans result['trace'] quand l'option 'trace'
+est active : ils traversent ainsi le pool de processus et le serveur OCR.
+Le Tracer du script principal les rassemble avec ses propres etapes
+(regroupement, ecriture du DOCX) et affiche un tableau recapitulatif.
+'''
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def trace_event(name, seconds, **args):
+    '''Evenement termine a l'instant, d'une duree de seconds'''
+    dur = seconds * 1e6
+    return {'name': name, 'ph': 'X', 'ts': time.time_ns() / 1000 - dur, 'dur': dur,
+            'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args}
+
+
+class Tracer:
+    '''Collecte les evenements d'une extraction (thread-safe)'''
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **args):
+        '''Mesure un bloc ; le dict cede peut recevoir des compteurs'''
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            event = trace_event(name, time.perf_counter() - start, **args)
+            with self._lock:
+                self.events.append(event)
+
+    def add_page(self, result):
+        '''Evenements d'une page venant du pipeline, du pool ou du serveur'''
+        page = os.path.basename(result['path'])
+        with self._lock:
+            for event in result.get('trace') or ():
+                event['args'].setdefault('page', page)
+                self.events.append(event)
+
+    def write(self, path):
+        '''.json : format Chrome trace ; sinon un evenement par ligne (JSONL)'''
+        with self._lock:
+            events = sorted(self.events, key=lambda e: e['ts'])
+        with open(path, 'w', encoding='utf-8') as f:
+            if str(path).endswith('.json'):
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+            else:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+    def summary(self):
+        '''[(etape, nombre, total s, moyenne ms, p50 ms, p95 ms, max ms, boites, octets)]'''
+        with self._lock:
+            events = list(self.events)
+        groups = {}
+        for event in events:
+            groups.setdefault(event['name'], []).append(event)
+
+        rows = []
+        for name, group in groups.items():
+            durations = np.array([e['dur'] for e in group]) / 1000
+            boxes = sum(e['args'].get('boxes', 0) for e in group)
+            read = sum(e['args'].get('bytes', 0) for e in group)
+            rows.append((name, len(group), durations.sum() / 1000, durations.mean(),
+                         np.percentile(durations, 50), np.percentile(durations, 95),
+                         durations.max(), boxes, read))
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+    def format_summary(self):
+        lines = [f'{"etape":<12} {"nb":>6} {"total":>9} {"moy":>9} {"p50":>9} {"p95":>9} {"max":>9} {"boites":>7} {"octets":>10}']
+        for name, count, total, mean, p50, p95, peak, boxes, read in self.summary():
+            lines.append(f'{name:<12} {count:>6} {total:>8.2f}s {mean:>7.1f}ms {p50:>7.1f}ms '
+                         f'{p95:>7.1f}ms {peak:>7.1f}ms {boxes or "":>7} {read or "":>10}')
+        return '\n'.join(lines)